@@ -0,0 +1,111 @@
+"""A fake webdriver and the local HTTP server it loads its pages from."""
+import random
+import urllib2
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Lock, Thread
+from time import sleep, time
+from urlparse import parse_qs, urlsplit
+
+from selenium.common.exceptions import WebDriverException
+
+PAGE_HEAD = '<html><head><title>%s</title></head><body>\n'
+PAGE_LINE = '<p><a href="/page/%d">Link %d</a> lorem ipsum dolor sit amet</p>\n'
+PAGE_TAIL = '</body></html>\n'
+
+
+def page(path, size):
+    """Return an HTML page of about the given size, in bytes."""
+    lines = [PAGE_HEAD % path]
+    length = len(lines[0]) + len(PAGE_TAIL)
+    i = 0
+    while length < size:
+        lines.append(PAGE_LINE % (i, i))
+        length += len(lines[-1])
+        i += 1
+    lines.append(PAGE_TAIL)
+    return ''.join(lines)
+
+
+class _PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        size = int(parse_qs(parts.query).get('size', ['1024'])[0])
+        body = page(parts.path, size)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class PageServer(object):
+    """Serves pages of any size (the ``size`` query argument) on a local
+    port, from a background thread."""
+    def __init__(self):
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), _PageHandler)
+        self._thread = Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeWebdriver(object):
+    """A webdriver that loads pages over HTTP without rendering them.
+
+    Navigations take ``latency`` seconds more (give or take ``jitter``), and
+    fail with a ``WebDriverException`` at the given ``failure_rate``. The
+    time each navigation starts is kept in ``navigations``, by URL.
+
+    It is configured through ``WEBDRIVER_OPTIONS``, like a real webdriver.
+
+    """
+    navigations = {}
+    _lock = Lock()
+
+    def __init__(self, latency=0.05, jitter=0.01, failure_rate=0.0,
+                 desired_capabilities=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.current_url = 'about:blank'
+        self.page_source = u'<html><head></head><body></body></html>'
+
+    def get(self, url):
+        with self._lock:
+            self.navigations[url] = time()
+        sleep(max(0, random.gauss(self.latency, self.jitter)))
+        if random.random() < self.failure_rate:
+            raise WebDriverException('Simulated navigation failure')
+        self.page_source = urllib2.urlopen(url).read().decode('utf-8')
+        self.current_url = url
+
+    def implicitly_wait(self, seconds):
+        pass
+
+    def set_script_timeout(self, seconds):
+        pass
+
+    def set_page_load_timeout(self, seconds):
+        pass
+
+    def quit(self):
+        pass
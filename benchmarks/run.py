@@ -0,0 +1,187 @@
+"""Throughput benchmarks of the spider middleware, download handler and
+webdriver manager.
+
+Each scenario crawls pages from a local HTTP server with ``FakeWebdriver``
+instances, in a process of its own, and reports the pages per second, the
+p50 and p99 latencies (from the start of a navigation to the callback), and
+the peak resident memory of the crawl. Run from the repository root:
+
+    python -m benchmarks.run [scenario ...] [--save results.json]
+    python -m benchmarks.run --compare results.json
+
+With ``--compare``, the run fails when a scenario is slower than in the
+saved results by more than the ``--tolerance``.
+
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+from time import time
+
+from scrapy.crawler import Crawler
+from scrapy.settings import Settings
+from scrapy.signals import spider_closed
+from scrapy.spider import BaseSpider
+from twisted.internet import reactor
+
+from benchmarks.fakes import FakeWebdriver, PageServer
+from scrapy_webdriver.http import WebdriverRequest
+
+BASE_SETTINGS = dict(
+    DOWNLOAD_HANDLERS={
+        'http': 'scrapy_webdriver.download.WebdriverDownloadHandler',
+        'https': 'scrapy_webdriver.download.WebdriverDownloadHandler',
+    },
+    SPIDER_MIDDLEWARES={
+        'scrapy_webdriver.middlewares.WebdriverSpiderMiddleware': 543,
+    },
+    WEBDRIVER_BROWSER=FakeWebdriver,
+)
+DEFAULTS = dict(pool_size=1, page_size=20 * 1024, latency=0.05,
+                failure_rate=0.0, settings={})
+SCENARIOS = [
+    ('single', {}),
+    ('pool', {'pool_size': 4}),
+    ('snapshot', {'pool_size': 4, 'settings': {'WEBDRIVER_SNAPSHOT': True}}),
+    ('large-pages', {'pool_size': 4, 'page_size': 1024 * 1024}),
+    ('failures', {'pool_size': 4, 'failure_rate': 0.05}),
+]
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class BenchmarkSpider(BaseSpider):
+    name = 'benchmark'
+
+    def __init__(self, urls, **kwargs):
+        super(BenchmarkSpider, self).__init__(**kwargs)
+        self.urls = urls
+        self.latencies = []
+        self.failures = 0
+
+    def start_requests(self):
+        for url in self.urls:
+            yield WebdriverRequest(url)
+
+    def parse(self, response):
+        started = FakeWebdriver.navigations.pop(response.request.url)
+        self.latencies.append(time() - started)
+        if response.exception:
+            self.failures += 1
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.))]
+
+
+def run_scenario(name, pages):
+    """Crawl the pages of a scenario in this process, return its results."""
+    config = dict(DEFAULTS, **dict(SCENARIOS)[name])
+    server = PageServer()
+    server.start()
+    urls = ['%s/page/%d?size=%d' % (server.url, i, config['page_size'])
+            for i in xrange(pages)]
+    settings = dict(BASE_SETTINGS, WEBDRIVER_POOL_SIZE=config['pool_size'],
+                    WEBDRIVER_OPTIONS={
+                        'latency': config['latency'],
+                        'failure_rate': config['failure_rate'],
+                    }, **config['settings'])
+    crawler = Crawler(Settings(values=settings))
+    crawler.configure()
+    crawler.signals.connect(reactor.stop, signal=spider_closed)
+    spider = BenchmarkSpider(urls)
+    crawler.crawl(spider)
+    started = time()
+    crawler.start()
+    reactor.run()
+    elapsed = time() - started
+    server.stop()
+    return {
+        'scenario': name,
+        'pages': len(spider.latencies),
+        'failures': spider.failures,
+        'pages_per_sec': len(spider.latencies) / elapsed,
+        'p50_ms': percentile(spider.latencies, 50) * 1000,
+        'p99_ms': percentile(spider.latencies, 99) * 1000,
+        # kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024.,
+    }
+
+
+def run(names, pages):
+    """Run each scenario in a new process, the reactor not being
+    restartable."""
+    results = []
+    for name in names:
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmarks.run', '--worker', name,
+             '--pages', str(pages)], cwd=ROOT)
+        results.append(json.loads(output.splitlines()[-1]))
+    return results
+
+
+def report(results, baseline=None):
+    print '%-12s %6s %8s %9s %9s %9s %9s' % (
+        'scenario', 'pages', 'failed', 'pages/s', 'p50 ms', 'p99 ms',
+        'rss MB')
+    for result in results:
+        line = '%(scenario)-12s %(pages)6d %(failures)8d ' \
+            '%(pages_per_sec)9.1f %(p50_ms)9.1f %(p99_ms)9.1f ' \
+            '%(peak_rss_mb)9.1f' % result
+        if baseline and result['scenario'] in baseline:
+            line += '  (%+.0f%% pages/s)' % (100 * (
+                result['pages_per_sec'] /
+                baseline[result['scenario']]['pages_per_sec'] - 1))
+        print line
+
+
+def regressions(results, baseline, tolerance):
+    """Return the scenarios slower than in the baseline, past tolerance."""
+    return [result['scenario'] for result in results
+            if result['scenario'] in baseline and result['pages_per_sec'] <
+            baseline[result['scenario']]['pages_per_sec'] * (1 - tolerance)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scenarios', nargs='*',
+                        help='scenarios to run (default: all of them)')
+    parser.add_argument('--pages', type=int, default=200,
+                        help='pages crawled per scenario')
+    parser.add_argument('--save', help='save the results to this file')
+    parser.add_argument('--compare', help='compare with the saved results')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown allowed by --compare (default: 0.2)')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print json.dumps(run_scenario(args.worker, args.pages))
+        return 0
+    names = args.scenarios or [name for name, _ in SCENARIOS]
+    unknown = set(names) - set(dict(SCENARIOS))
+    if unknown:
+        parser.error('unknown scenarios: %s' % ', '.join(sorted(unknown)))
+    baseline = None
+    if args.compare:
+        baseline = dict((result['scenario'], result)
+                        for result in json.load(open(args.compare)))
+    results = run(names, args.pages)
+    report(results, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline:
+        slower = regressions(results, baseline, args.tolerance)
+        if slower:
+            print 'Throughput regression in: %s' % ', '.join(slower)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
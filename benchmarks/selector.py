@@ -0,0 +1,230 @@
+"""Round trip benchmarks of ``scrapy_webdriver.selector``.
+
+Each extraction pattern runs on pages of several sizes, through a real
+selenium ``WebDriver`` whose command executor is a ``FakeBrowser`` that
+evaluates the commands on an lxml document, and charges a latency per
+command. The number of commands of each pattern is checked against the
+baseline recorded in ``selector_baseline.json``, and the run fails when a
+pattern issues more. Run from the repository root:
+
+    python -m benchmarks.selector [--latency 0.005] [--save]
+
+With ``--save``, the baseline is updated with the counts of the run.
+
+"""
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+from time import sleep, time
+
+from cssselect import HTMLTranslator
+from lxml import html
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from scrapy_webdriver.http import WebdriverResponse
+from scrapy_webdriver.selector import (GET_TEXTS, SELECT_STRINGS,
+                                       WebdriverXPathSelector)
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'selector_baseline.json')
+SIZES = (10, 100, 1000)
+ROW = ('<tr><td class="name"><a href="/item/%d">Item <b>%d</b></a></td>'
+       '<td class="price">%d.99</td></tr>')
+LINKS = "return document.getElementsByTagName('a');"
+# no error, in the JSON wire protocol
+SUCCESS = 0
+UNKNOWN_COMMAND = 9
+
+
+def page(rows):
+    """Return a page with a table of that many rows."""
+    return ('<html><body><table>%s</table></body></html>' %
+            ''.join(ROW % (i, i, i) for i in xrange(rows)))
+
+
+def text_nodes(element, recurse):
+    """Return the text nodes of an element, as ``SELECT_STRINGS`` does."""
+    texts = [element.text] if element.text else []
+    for child in element:
+        if recurse:
+            texts.extend(text_nodes(child, True))
+        if child.tail:
+            texts.append(child.tail)
+    return texts
+
+
+class FakeBrowser(object):
+    """A WebDriver command executor evaluating commands on an lxml document.
+
+    The element finding commands, the text and attribute getters, and the
+    scripts of the selector are supported, as well as the scripts given in
+    ``scripts`` (a dict of functions taking the script arguments). Every
+    command sleeps for ``latency`` seconds and is counted in ``commands``.
+
+    """
+    def __init__(self, source, latency=0, scripts=None):
+        self.source = source
+        self.document = html.fromstring(source)
+        self.latency = latency
+        self.scripts = {
+            SELECT_STRINGS: self._select_strings,
+            GET_TEXTS: self._get_texts,
+        }
+        self.scripts.update(scripts or {})
+        self.commands = defaultdict(int)
+        self._elements = []
+        self._css = HTMLTranslator()
+
+    def execute(self, command, params):
+        if command == Command.NEW_SESSION:
+            return {'status': SUCCESS, 'sessionId': 'benchmark', 'value': {}}
+        self.commands[command] += 1
+        sleep(self.latency)
+        handler = getattr(self, '_%s' % command, None)
+        if handler is None:
+            return {'status': UNKNOWN_COMMAND, 'value': {'message': command}}
+        return {'status': SUCCESS, 'value': handler(params)}
+
+    @property
+    def total(self):
+        return sum(self.commands.itervalues())
+
+    def _find(self, context, using, value):
+        if using == 'css selector':
+            value = self._css.css_to_xpath(value)
+        elif using != 'xpath':
+            raise ValueError('Unsupported locator %r' % using)
+        return [self._wrap(element) for element in context.xpath(value)]
+
+    def _wrap(self, element):
+        self._elements.append(element)
+        return {'ELEMENT': str(len(self._elements) - 1)}
+
+    def _unwrap(self, value):
+        if isinstance(value, dict) and 'ELEMENT' in value:
+            return self._elements[int(value['ELEMENT'])]
+        if isinstance(value, list):
+            return [self._unwrap(item) for item in value]
+        return value
+
+    def _getPageSource(self, params):
+        return self.source
+
+    def _findElements(self, params):
+        return self._find(self.document, params['using'], params['value'])
+
+    def _findChildElements(self, params):
+        return self._find(self._unwrap({'ELEMENT': params['id']}),
+                          params['using'], params['value'])
+
+    def _getElementText(self, params):
+        return self._unwrap({'ELEMENT': params['id']}).text_content().strip()
+
+    def _getElementAttribute(self, params):
+        return self._unwrap({'ELEMENT': params['id']}).get(params['name'])
+
+    def _executeScript(self, params):
+        args = self._unwrap(params['args'])
+        result = self.scripts[params['script']](*args)
+        if isinstance(result, list):
+            return [self._wrap(item) if isinstance(item, html.HtmlElement)
+                    else item for item in result]
+        return result
+
+    def _select_strings(self, context, query, by_css, attribute, recurse):
+        if by_css:
+            query = self._css.css_to_xpath(query)
+        elements = (context if context is not None else self.document).xpath(
+            query)
+        if attribute:
+            return [element.get(attribute) for element in elements]
+        return [text for element in elements
+                for text in text_nodes(element, recurse)]
+
+    def _get_texts(self, elements):
+        return [element.text_content().strip() for element in elements]
+
+
+def _links(browser):
+    return lambda: list(browser.document.iter('a'))
+
+
+# The extraction patterns, as functions of a live selector and a snapshot
+# selector.
+PATTERNS = [
+    ('xpath //text()',
+     lambda live, snapshot: live.xpath('//td//text()').extract()),
+    ('css ::attr(href)',
+     lambda live, snapshot: live.css('a::attr(href)').extract()),
+    ('select_script',
+     lambda live, snapshot: live.select_script(LINKS).extract()),
+    ('xpath extract()',
+     lambda live, snapshot: live.xpath('//td[@class="price"]').extract()),
+    ('snapshot xpath',
+     lambda live, snapshot: snapshot.xpath('//td//text()').extract()),
+]
+
+
+def measure(sizes=SIZES, latency=0):
+    """Return the commands and seconds of each pattern, by page size."""
+    results = defaultdict(dict)
+    for size in sizes:
+        source = page(size)
+        for name, pattern in PATTERNS:
+            browser = FakeBrowser(source, latency)
+            browser.scripts[LINKS] = _links(browser)
+            webdriver = WebDriver(browser, desired_capabilities={})
+            response = WebdriverResponse('http://benchmark/', webdriver)
+            live = WebdriverXPathSelector(webdriver=webdriver)
+            browser.commands.clear()
+            started = time()
+            pattern(live, response.selector)
+            results[name][str(size)] = {
+                'commands': browser.total,
+                'seconds': time() - started,
+            }
+    return results
+
+
+def regressions(results, baseline):
+    """Return the patterns and sizes issuing more commands than in the
+    baseline."""
+    return [(name, size) for name, sizes in sorted(results.iteritems())
+            for size, result in sorted(sizes.iteritems())
+            if result['commands'] > baseline.get(name, {}).get(size, 0)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='seconds charged per command (default: 0.002)')
+    parser.add_argument('--save', action='store_true',
+                        help='record the command counts as the baseline')
+    args = parser.parse_args(argv)
+
+    results = measure(latency=args.latency)
+    print '%-18s %6s %9s %9s' % ('pattern', 'rows', 'commands', 'ms')
+    for name, _ in PATTERNS:
+        for size in SIZES:
+            result = results[name][str(size)]
+            print '%-18s %6d %9d %9.1f' % (name, size, result['commands'],
+                                           result['seconds'] * 1000)
+    if args.save:
+        with open(BASELINE, 'w') as f:
+            json.dump(dict((name, dict((size, result['commands'])
+                                       for size, result in sizes.items()))
+                           for name, sizes in results.items()),
+                      f, indent=2, separators=(',', ': '), sort_keys=True)
+            f.write('\n')
+        return 0
+    worse = regressions(results, json.load(open(BASELINE)))
+    for name, size in worse:
+        print 'Round trip regression: %s on %s rows' % (name, size)
+    return 1 if worse else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
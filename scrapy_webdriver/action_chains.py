@@ -1,17 +1,144 @@
+import json
 from functools import partial
 
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as ec
+from selenium.webdriver.support.select import Select
 from selenium.webdriver.support.wait import WebDriverWait
 
+from .wait import (NAVIGATED, WAIT_FUNCTION, WAIT_UNTIL,
+                   extend_script_timeout, timeouts)
+
+# Find the elements of a selenium locator, in the browser.
+LOCATE = """
+function locate(by, value) {
+    var nodes, result = [], i, text;
+    switch (by) {
+    case 'id':
+        nodes = [document.getElementById(value)];
+        break;
+    case 'css selector':
+        nodes = document.querySelectorAll(value);
+        break;
+    case 'class name':
+        nodes = document.getElementsByClassName(value);
+        break;
+    case 'tag name':
+        nodes = document.getElementsByTagName(value);
+        break;
+    case 'name':
+        nodes = document.getElementsByName(value);
+        break;
+    case 'xpath':
+        var snapshot = document.evaluate(
+            value, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE,
+            null);
+        nodes = [];
+        for (i = 0; i < snapshot.snapshotLength; i++) {
+            nodes.push(snapshot.snapshotItem(i));
+        }
+        break;
+    case 'link text':
+    case 'partial link text':
+        nodes = [];
+        var links = document.getElementsByTagName('a');
+        for (i = 0; i < links.length; i++) {
+            text = (links[i].innerText || links[i].textContent).trim();
+            if (by == 'link text' ? text == value :
+                    text.indexOf(value) != -1) {
+                nodes.push(links[i]);
+            }
+        }
+        break;
+    }
+    for (i = 0; i < nodes.length; i++) {
+        if (nodes[i]) {
+            result.push(nodes[i]);
+        }
+    }
+    return result;
+}
+function visible(element) {
+    var style = window.getComputedStyle(element);
+    return element.getClientRects().length > 0 &&
+        style.visibility != 'hidden' && style.display != 'none';
+}
+"""
+
+# The JavaScript counterparts of the expected conditions taking a locator, as
+# expressions of the located ``elements`` and the extra argument ``arg``.
+LOCATED_CONDITIONS = {
+    'presence_of_element_located': 'elements.length > 0',
+    'presence_of_all_elements_located': 'elements.length > 0',
+    'visibility_of_element_located':
+        'elements.length > 0 && visible(elements[0])',
+    'invisibility_of_element_located':
+        'elements.length == 0 || !visible(elements[0])',
+    'element_to_be_clickable':
+        'elements.length > 0 && visible(elements[0]) && '
+        '!elements[0].disabled',
+    'text_to_be_present_in_element':
+        'elements.length > 0 && (elements[0].innerText || '
+        'elements[0].textContent).indexOf(arg) != -1',
+    'text_to_be_present_in_element_value':
+        'elements.length > 0 && (elements[0].value || "").indexOf(arg) != -1',
+    'element_located_to_be_selected':
+        'elements.length > 0 && !!(elements[0].selected || '
+        'elements[0].checked)',
+    'element_located_selection_state_to_be':
+        'elements.length > 0 && !!(elements[0].selected || '
+        'elements[0].checked) == arg',
+}
+TITLE_CONDITIONS = {
+    'title_is': 'document.title == arg',
+    'title_contains': 'document.title.indexOf(arg) != -1',
+}
+LOCATORS = (By.ID, By.CSS_SELECTOR, By.CLASS_NAME, By.TAG_NAME, By.NAME,
+            By.XPATH, By.LINK_TEXT, By.PARTIAL_LINK_TEXT)
+
+
+def compile_condition(name, args):
+    """Return a JavaScript predicate for an expected condition.
+
+    Return None for the conditions that can't be evaluated in the browser,
+    like those taking a WebElement, or switching to a frame or an alert.
+
+    """
+    if name in TITLE_CONDITIONS:
+        return 'var arg = %s;\nreturn %s;' % (json.dumps(args[0]),
+                                             TITLE_CONDITIONS[name])
+    if name not in LOCATED_CONDITIONS:
+        return None
+    locator, extra = args[0], args[1:]
+    if (not isinstance(locator, (tuple, list)) or len(locator) != 2 or
+            locator[0] not in LOCATORS):
+        return None
+    return '%s\nvar elements = locate(%s, %s), arg = %s;\nreturn %s;' % (
+        LOCATE, json.dumps(locator[0]), json.dumps(locator[1]),
+        json.dumps(extra[0] if extra else None), LOCATED_CONDITIONS[name])
+
 
 class WaitingActionChains(ActionChains):
-    """ActionChains that wait on conditions."""
+    """ActionChains that wait on conditions.
+
+    Conditions given by the name of one of the ``expected_conditions`` taking
+    a locator or a title are evaluated in the browser, by a single script
+    that resolves as soon as a DOM mutation makes them true. The other
+    conditions are polled with ``WebDriverWait``.
+
+    """
     def wait(self, timeout, condition=None, name=None, args=None):
         """Add a waiting action to the stack."""
         if args is None:
             args = []
         if name:
+            predicate = compile_condition(name, args)
+            if predicate is not None:
+                self._actions.append(partial(self._wait_in_browser, timeout,
+                                             predicate, name))
+                return self
             condition = getattr(ec, name)(*args)
         if condition is None:
             raise ValueError('You must provide a condition, either directly '
@@ -21,3 +148,203 @@ class WaitingActionChains(ActionChains):
             return WebDriverWait(self._driver, timeout).until(condition)
         self._actions.append(partial(do_wait, condition))
         return self
+
+    def _wait_in_browser(self, timeout, predicate, name):
+        # leave the script time to give up on its own
+        extend_script_timeout(self._driver, timeout + 1)
+        if not self._driver.execute_async_script(
+                WAIT_UNTIL, {'js': predicate}, timeout * 1000):
+            raise TimeoutException('Timed out waiting for %s' % name)
+
+
+# Run compiled steps one after the other, and call back with the index of the
+# first step that couldn't be run, flagged with why, or with the number of
+# steps once they all ran. A click ends the steps, flagged with whether it
+# navigates away, in which case the page is flagged as stale (see NAVIGATED).
+RUN_STEPS = LOCATE + WAIT_FUNCTION + """
+var steps = arguments[0], done = arguments[arguments.length - 1];
+
+function fire(element, type) {
+    var event = document.createEvent('HTMLEvents');
+    event.initEvent(type, true, true);
+    element.dispatchEvent(event);
+}
+
+function run(i) {
+    for (; i < steps.length; i++) {
+        var step = steps[i], element = step.element;
+        if (step.kind == 'wait') {
+            waitUntil({js: step.js}, step.timeout, function (ready) {
+                if (ready) {
+                    run(i + 1);
+                } else {
+                    done({index: i, timeout: true});
+                }
+            });
+            return;
+        }
+        if (step.locator) {
+            element = locate(step.locator[0], step.locator[1])[0];
+        }
+        if ((step.locator || step.element) && !element) {
+            return done({index: i, native: true});
+        }
+        switch (step.kind) {
+        case 'click':
+            if (!element.click) {
+                return done({index: i, native: true});
+            }
+            element.scrollIntoView();
+            window.addEventListener('beforeunload', function () {
+                window.__webdriverStale = true;
+            });
+            element.click();
+            // navigations start after the tasks the click queued
+            return setTimeout(function () {
+                done({index: i + 1, navigating: !!window.__webdriverStale});
+            }, 0);
+        case 'type':
+            if (element.type == 'file' || element.isContentEditable) {
+                return done({index: i, native: true});
+            }
+            element.focus();
+            element.value += step.text;
+            fire(element, 'input');
+            fire(element, 'change');
+            break;
+        case 'scroll':
+            if (element) {
+                element.scrollIntoView();
+            } else {
+                window.scrollTo(step.x, step.y);
+            }
+            break;
+        case 'select':
+            element.value = step.value;
+            fire(element, 'change');
+            break;
+        }
+    }
+    done({index: steps.length});
+}
+run(0);
+"""
+
+
+class _Step(object):
+    """An action compiled to JavaScript, with its native counterpart."""
+    def __init__(self, kind, native, target=None, **args):
+        self.kind = kind
+        self.native = native
+        self.timeout = args.get('timeout', 0) / 1000.
+        self.args = dict(args, kind=kind)
+        if isinstance(target, (tuple, list)):
+            self.args['locator'] = list(target)
+        elif target is not None:
+            self.args['element'] = target
+
+
+class CompiledActionChains(WaitingActionChains):
+    """WaitingActionChains that run in the page, in as few round trips as
+    possible.
+
+    Clicks, typing, scrolling, selecting and waiting on the conditions that
+    ``WaitingActionChains`` evaluates in the browser are compiled to
+    JavaScript, and consecutive compiled actions run in a single script, up to
+    the next click. When a click navigates away, the actions after it wait for
+    the new page to be loaded. Their target can be a WebElement or a locator,
+    like ``(By.CSS_SELECTOR, 'a')``.
+
+    The other actions, like moving the mouse or typing special keys, are
+    performed natively. So are the compiled actions that synthetic events
+    can't do, like typing into a file input.
+
+    """
+    def click(self, on_element=None):
+        if on_element is None:
+            return super(CompiledActionChains, self).click()
+        native = lambda: self._element(on_element).click()
+        self._actions.append(_Step('click', native, on_element))
+        return self
+
+    def send_keys_to_element(self, element, *keys_to_send):
+        text = u''.join(unicode(key) for key in keys_to_send)
+        if any(u'\ue000' <= key <= u'\uf8ff' for key in text):
+            # special keys like Keys.ENTER need real key events
+            return super(CompiledActionChains, self).send_keys_to_element(
+                self._element(element), *keys_to_send)
+        native = lambda: self._element(element).send_keys(text)
+        self._actions.append(_Step('type', native, element, text=text))
+        return self
+
+    def scroll_to(self, element=None, x=0, y=0):
+        """Scroll an element into view, or the window to a position."""
+        native = lambda: self._driver.execute_script(
+            'arguments[0].scrollIntoView();', self._element(element))
+        self._actions.append(_Step('scroll', native, element, x=x, y=y))
+        return self
+
+    def select(self, element, value):
+        """Select the option of a select element with the given value."""
+        native = lambda: Select(self._element(element)).select_by_value(value)
+        self._actions.append(_Step('select', native, element, value=value))
+        return self
+
+    def wait(self, timeout, condition=None, name=None, args=None):
+        if name:
+            predicate = compile_condition(name, args or [])
+            if predicate is not None:
+                native = partial(self._timed_out, name)
+                self._actions.append(_Step('wait', native, js=predicate,
+                                           timeout=timeout * 1000))
+                return self
+        return super(CompiledActionChains, self).wait(timeout, condition,
+                                                      name, args)
+
+    def perform(self):
+        steps = []
+        for action in self._actions + [None]:
+            if isinstance(action, _Step):
+                steps.append(action)
+                if action.kind == 'click':
+                    self._run(steps)
+                    steps = []
+                continue
+            if steps:
+                self._run(steps)
+                steps = []
+            if action is not None:
+                action()
+
+    def _run(self, steps):
+        """Run compiled steps, performing natively those that need to be."""
+        while steps:
+            # leave the script time to give up on its own
+            extend_script_timeout(self._driver,
+                                  sum(step.timeout for step in steps) + 1)
+            result = self._driver.execute_async_script(
+                RUN_STEPS, [step.args for step in steps])
+            index = result['index']
+            if result.get('navigating'):
+                self._wait_navigated()
+            if index == len(steps):
+                return
+            # the step either timed out waiting, or needs to be native
+            steps[index].native()
+            steps = steps[index + 1:]
+
+    def _wait_navigated(self):
+        """Wait for the page a click navigated to to be loaded."""
+        timeout = timeouts(self._driver).get('page load') or 300
+        # the page being navigated away from may fail scripts
+        wait = WebDriverWait(self._driver, timeout, 0.05,
+                             ignored_exceptions=(WebDriverException,))
+        wait.until(lambda driver: driver.execute_script(NAVIGATED, 'normal'))
+
+    def _timed_out(self, name):
+        raise TimeoutException('Timed out waiting for %s' % name)
+
+    def _element(self, element):
+        if isinstance(element, (tuple, list)):
+            return self._driver.find_element(*element)
+        return element
@@ -0,0 +1,70 @@
+"""Detectors deciding whether a statically downloaded page needs webdriver.
+
+Detectors are used by the download handler for requests in static-first mode
+(see ``WEBDRIVER_STATIC_FIRST``). Each one is instantiated with the settings,
+and its ``needs_webdriver`` method is given the request and the response from
+the fallback download handler. It returns a short reason when the page must be
+rendered in a browser instead, and something false otherwise.
+
+"""
+import re
+
+from scrapy.http import TextResponse
+from scrapy.selector import Selector
+
+_NOSCRIPT = re.compile(r'<noscript[^>]*>(.*?)</noscript>', re.I | re.S)
+_JAVASCRIPT_REQUIRED = re.compile(r'javascript|browser', re.I)
+
+
+class ExpectedSelectorDetector(object):
+    """Escalates when the page lacks the content the spider expects.
+
+    The expected content is given per request, with the
+    ``webdriver_expect_css`` or ``webdriver_expect_xpath`` meta keys.
+
+    """
+    def __init__(self, settings):
+        pass
+
+    def needs_webdriver(self, request, response):
+        css = request.meta.get('webdriver_expect_css')
+        xpath = request.meta.get('webdriver_expect_xpath')
+        if not (css or xpath) or not isinstance(response, TextResponse):
+            return
+        selector = Selector(response)
+        if css and not selector.css(css):
+            return 'missing %s' % css
+        if xpath and not selector.xpath(xpath):
+            return 'missing %s' % xpath
+
+
+class NoscriptDetector(object):
+    """Escalates when the page asks for JavaScript in a <noscript> element."""
+    def __init__(self, settings):
+        pass
+
+    def needs_webdriver(self, request, response):
+        if not isinstance(response, TextResponse):
+            return
+        for content in _NOSCRIPT.findall(response.body):
+            if _JAVASCRIPT_REQUIRED.search(content):
+                return 'noscript'
+
+
+class BodySizeDetector(object):
+    """Escalates when the page is too small to hold actual content.
+
+    The minimum size is given by the ``WEBDRIVER_STATIC_MIN_BODY_SIZE``
+    setting, in bytes. It defaults to 2048, which about fits the bare shell of
+    a page that builds its content with JavaScript.
+
+    """
+    def __init__(self, settings):
+        self._min_size = settings.getint('WEBDRIVER_STATIC_MIN_BODY_SIZE',
+                                         2048)
+
+    def needs_webdriver(self, request, response):
+        if not isinstance(response, TextResponse):
+            return
+        if len(response.body) < self._min_size:
+            return 'body size %d' % len(response.body)
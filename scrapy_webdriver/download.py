@@ -1,13 +1,24 @@
-import signal
+from time import time
+from urlparse import urldefrag
 
 from scrapy import log
 from scrapy.utils.decorator import inthread
 from scrapy.utils.misc import load_object
 from scrapy.exceptions import IgnoreRequest
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+from twisted.internet import defer, reactor
 
 from .http import WebdriverActionRequest, WebdriverRequest, WebdriverResponse
+from .wait import NAVIGATE, NAVIGATED, STRATEGIES, WAIT_UNTIL, timeouts
+from .watchdog import WebdriverWatchdog
 
 FALLBACK_HANDLER = 'scrapy.core.downloader.handlers.http10.HTTP10DownloadHandler'
+STATIC_DETECTORS = [
+    'scrapy_webdriver.detectors.ExpectedSelectorDetector',
+    'scrapy_webdriver.detectors.NoscriptDetector',
+    'scrapy_webdriver.detectors.BodySizeDetector',
+]
 
 class WebdriverTimeout(Exception):
     pass
@@ -22,67 +33,158 @@ class WebdriverDownloadHandler(object):
         self._enabled = settings.get('WEBDRIVER_BROWSER') is not None
         self._timeout = settings.get('WEBDRIVER_TIMEOUT')
         self._hang_timeout = settings.get('WEBDRIVER_HANG_TIMEOUT', None)
+        self._hang_retries = settings.getint('WEBDRIVER_HANG_RETRIES', 1)
+        self._watchdog = None
+        if self._hang_timeout:
+            self._watchdog = WebdriverWatchdog(self._hang_timeout)
+        self._snapshot = settings.getbool('WEBDRIVER_SNAPSHOT', False)
+        self._wait_timeout = settings.getfloat('WEBDRIVER_WAIT_TIMEOUT', 10)
+        # the WebDriver defaults stand in for the unset timeouts
+        self._page_load_timeout = settings.get('WEBDRIVER_PAGE_LOAD_TIMEOUT',
+                                               self._timeout) or 300
+        self._script_timeout = settings.get('WEBDRIVER_SCRIPT_TIMEOUT',
+                                            self._timeout) or 30
+        self._page_load_strategy = settings.get('WEBDRIVER_PAGE_LOAD_STRATEGY',
+                                                None) or 'normal'
+        if self._page_load_strategy not in STRATEGIES:
+            raise ValueError('Unknown WEBDRIVER_PAGE_LOAD_STRATEGY %r.' %
+                             self._page_load_strategy)
+        self._compiled_actions = settings.getbool('WEBDRIVER_COMPILED_ACTIONS',
+                                                  False)
+        self._warned_tabs = False
+        self._backend = settings.get('WEBDRIVER_BACKEND', 'selenium')
         self._fallback_handler = load_object(FALLBACK_HANDLER)(settings)
+        self._static_first = settings.getbool('WEBDRIVER_STATIC_FIRST', False)
+        self._detectors = [load_object(path)(settings) for path in
+                           settings.getlist('WEBDRIVER_STATIC_DETECTORS',
+                                            STATIC_DETECTORS)]
 
     def download_request(self, request, spider):
         """Return the result of the right download method for the request."""
         if self._enabled and isinstance(request, WebdriverRequest):
 
-            # set the signal handler for the SIGALRM event
-            if self._hang_timeout:
+            if request.meta.pop('webdriver_cached', False):
+                return self._download_cached(request, spider)
 
-                def alarm_handler(signum, frame):
+            if self._is_static_first(request):
+                return self._download_static_first(request, spider)
+            return self._download_webdriver(request, spider)
+        return self._fallback_handler.download_request(request, spider)
 
-                    # kill the selenium webdriver process (with SIGTERM,
-                    # so that it kills both the primary process and the
-                    # process that gets spawned)
-                    try:
-                        service = request.manager.webdriver.service
-                        service.process.send_signal(signal.SIGTERM)
-                    except AttributeError:
-                        pass
+    def _download_webdriver(self, request, spider):
+        """Return the result of the right webdriver download method."""
+        if self._backend == 'twisted':
+            return self._download_request_async(request, spider)
 
-                    # set the defunct _webdriver attribute back to
-                    # original value of None, so that the next time it is
-                    # accessed it is recreated.
-                    request.manager._webdriver = None
+        if isinstance(request, WebdriverActionRequest):
+            download = self._do_action_request
+        else:
+            download = self._download_request
+        return download(request, spider)
 
-                    # log an informative warning message
-                    msg = "WebDriver.get for '%s' took more than WEBDRIVER_HANG_TIMEOUT (%ss)" % \
-                        (request.url, self._hang_timeout)
-                    spider.log(msg, level=log.INFO)
+    def _download_cached(self, request, spider):
+        """Replay the page found in the cache by the spider middleware,
+        without ever touching the webdriver.
 
-                # bind the handler
-                signal.signal(signal.SIGALRM, alarm_handler)
+        The page is only read from the cache now, not to be held by the
+        scheduled request. Should it have left the cache meanwhile, it is
+        rendered once the request is leased an instance, like escalated
+        static-first requests are.
 
-            if isinstance(request, WebdriverActionRequest):
-                download = self._do_action_request
-            else:
-                download = self._download_request
+        """
+        response = request.manager.cache.retrieve_response(spider, request)
+        if response is not None:
+            return defer.succeed(response)
+        dfd = request.manager.acquire_deferred(request)
+        dfd.addCallback(self._download_webdriver, spider)
+        return dfd
+
+    def _is_static_first(self, request):
+        """Return whether the request should first be downloaded without
+        webdriver (``WEBDRIVER_STATIC_FIRST`` or the ``webdriver_static_first``
+        request meta key)."""
+        if isinstance(request, WebdriverActionRequest):
+            return False
+        return request.meta.get('webdriver_static_first', self._static_first)
+
+    def _download_static_first(self, request, spider):
+        """Download the request with the fallback handler, and only escalate
+        to webdriver when one of the ``WEBDRIVER_STATIC_DETECTORS`` finds that
+        the page needs to be rendered in a browser.
+
+        The spider middleware doesn't lease a webdriver instance to such
+        requests, so the request only waits for one when escalating.
+
+        """
+        dfd = self._fallback_handler.download_request(request, spider)
+        dfd.addCallback(self._escalate, request, spider)
+        return dfd
+
+    def _escalate(self, response, request, spider):
+        for detector in self._detectors:
+            reason = detector.needs_webdriver(request, response)
+            if reason:
+                break
         else:
-            download = self._fallback_handler.download_request
-        return download(request, spider)
+            return response
+        log.msg('Escalating %s to webdriver (%s)' % (request.url, reason),
+                level=log.DEBUG, spider=spider)
+        dfd = request.manager.acquire_deferred(request)
+        dfd.addCallback(self._download_webdriver, spider)
+        dfd.addCallback(_flag_escalated)
+        return dfd
 
     @inthread
     def _download_request(self, request, spider):
-        """Download a request URL using webdriver."""
+        """Download a request URL using webdriver.
 
-        # set a countdown timer for the webdriver.get
-        if self._hang_timeout:
-            signal.alarm(self._hang_timeout)
+        With a ``WEBDRIVER_HANG_TIMEOUT``, a watchdog kills the browser when
+        the navigation hangs, and the navigation is retried in a new browser up
+        to ``WEBDRIVER_HANG_RETRIES`` times.
 
-        # make the get request
-        try:
-            request.manager.webdriver.get(request.url)
+        """
+        strategy = request.meta.get('webdriver_page_load_strategy')
+        if strategy is not None and strategy not in STRATEGIES:
+            # a misconfigured request, the browser is fine
+            exception = ValueError('Unknown webdriver_page_load_strategy %r.'
+                                   % (strategy,))
+            spider.log('Error while downloading %s with webdriver (%s)' %
+                       (request.url, exception), level=log.ERROR)
+            return self._response(request, request.url, exception)
 
-        # if the get fails for any reason, set the webdriver attribute of the
-        # response to the exception that occurred
-        except Exception, exception:
+        retries = 0
+        while True:
+            watch = None
+            if self._watchdog is not None:
+                watch = self._watchdog.watch(request.manager, request.url)
 
-            # since it's already failed, don't try to raise alarm anymore (this has no effect if the failure was due to the alarm)
-            if self._hang_timeout:
-                spider.log('settings alarm to 0 on FAILURE', level=log.DEBUG)
-                signal.alarm(0)
+            # make the get request
+            try:
+                self._set_timeouts(request)
+                self._block_resources(request)
+                started = time()
+                if not request.manager.switch_to_prefetched(
+                        request.url, self._strategy(request)):
+                    self._navigate(request)
+                request.manager.record_timing('get', time() - started)
+
+            # if the get fails for any reason, set the webdriver attribute of
+            # the response to the exception that occurred
+            except Exception, exception:
+                hung = watch is not None and self._watchdog.unwatch(watch)
+
+            # if the get finishes in time, return a response with the
+            # webdriver attached
+            else:
+                hung = watch is not None and self._watchdog.unwatch(watch)
+                if not hung:
+                    self._wait_until(request, spider)
+                    return self._response(request, request.url)
+
+            if hung:
+                exception = WebdriverTimeout(
+                    'WebDriver.get took more than WEBDRIVER_HANG_TIMEOUT '
+                    '(%ss)' % self._hang_timeout)
 
             # log a nice error message
             msg = 'Error while downloading %s with webdriver (%s)' % \
@@ -91,24 +193,265 @@ class WebdriverDownloadHandler(object):
 
             request.manager.reconnect()
 
-            return WebdriverResponse(request.url, request.manager.webdriver, exception)
+            if hung and retries < self._hang_retries:
+                retries += 1
+                spider.log('Retrying %s in a new webdriver (%d/%d)' %
+                           (request.url, retries, self._hang_retries),
+                           level=log.INFO)
+                continue
+            return self._response(request, request.url, exception)
 
-        # if the get finishes, defuse the bomb and return a response with the
-        # webdriver attached
-        else:
+    @defer.inlineCallbacks
+    def _download_request_async(self, request, spider):
+        """Download a request URL using the twisted webdriver backend.
+
+        The browser is driven from the reactor thread through the wire protocol
+        session of the leased instance. The response is always detached, the
+        lease being released as soon as the page source is captured.
 
-            # since it succeeded, don't raise any alarm
+        """
+        instance = request.manager
+        timer = None
+        try:
+            session = yield instance.session()
+            for kind, seconds in self._timeouts(request, session):
+                yield session.set_timeout(kind, seconds)
+            started = time()
+            navigation = session.get(request.url)
             if self._hang_timeout:
-                signal.alarm(0)
+                timer = reactor.callLater(self._hang_timeout,
+                                          navigation.cancel)
+            yield navigation
+            instance.record_timing('get', time() - started)
+            spec = request.meta.get('webdriver_wait_until')
+            if spec:
+                timeout = spec.get('timeout', self._wait_timeout)
+                script_timeout = timeouts(session).get('script')
+                if script_timeout is None or script_timeout < timeout + 1:
+                    yield session.set_timeout('script', timeout + 1)
+                    timeouts(session)['script'] = timeout + 1
+                ready = yield session.execute_async_script(
+                    WAIT_UNTIL, spec, timeout * 1000)
+                self._log_not_ready(request, ready, spider)
+            started = time()
+            page_source = yield session.page_source
+            instance.record_timing('page_source', time() - started)
+        except Exception, exception:
+            msg = 'Error while downloading %s with webdriver (%s)' % \
+                (request.url, exception)
+            spider.log(msg, level=log.ERROR)
+            instance.drop_session()
+            response = WebdriverResponse(request.url, None, exception)
+        else:
+            response = WebdriverResponse(request.url, None, body=page_source)
+            instance.record_size('page_source', len(response.body))
+        finally:
+            if timer is not None and timer.active():
+                timer.cancel()
+        instance.manager.release(request)
+        defer.returnValue(response)
 
-            # return the correct response
-            return WebdriverResponse(request.url, request.manager.webdriver)
-            
     @inthread
     def _do_action_request(self, request, spider):
-        """Perform an action on a previously webdriver-loaded page."""
+        """Perform an action on a previously webdriver-loaded page.
+
+        If the actions fail, the response is returned with the exception,
+        still holding the lease like the page it acted on.
+
+        """
         log.msg('Running webdriver actions %s' % request.url, level=log.DEBUG)
-        request.actions.perform()
+        try:
+            self._set_timeouts(request)
+            request.actions.perform()
+        except Exception, exception:
+            msg = 'Error while running webdriver actions on %s (%s)' % \
+                (request.url, exception)
+            spider.log(msg, level=log.ERROR)
+            return self._response(request, request.url, exception)
+        self._wait_until(request, spider)
         # Set the webdrivers current URL on the response, as an action may have
         # caused the page URL to have changed (e.g clicking a link).
-        return WebdriverResponse(request.manager.webdriver.current_url, request.manager.webdriver)
+        return self._response(request, request.manager.webdriver.current_url)
+
+    def _timeouts(self, request, target):
+        """Return the timeouts to set on a webdriver or session for a request.
+
+        Requests can have their own timeouts, in seconds, in the
+        ``webdriver_page_load_timeout`` and ``webdriver_script_timeout`` meta
+        keys. The others get the ``WEBDRIVER_*`` ones, or the WebDriver
+        defaults. Only the timeouts that differ from those last set on the
+        target are returned, as ``(kind, seconds)`` pairs, and they are
+        recorded as set.
+
+        """
+        changed = []
+        current = timeouts(target)
+        for kind, key, default in (
+                ('page load', 'webdriver_page_load_timeout',
+                 self._page_load_timeout),
+                ('script', 'webdriver_script_timeout', self._script_timeout)):
+            seconds = request.meta.get(key, default)
+            if current.get(kind) != seconds:
+                current[kind] = seconds
+                changed.append((kind, seconds))
+        return changed
+
+    def _set_timeouts(self, request):
+        webdriver = request.manager.webdriver
+        for kind, seconds in self._timeouts(request, webdriver):
+            if kind == 'page load':
+                webdriver.set_page_load_timeout(seconds)
+            else:
+                webdriver.set_script_timeout(seconds)
+
+    def _block_resources(self, request):
+        """Have the blocking proxy of the browser, if any, follow the
+        ``webdriver_block_resources`` spec of the request, or the default
+        ``WEBDRIVER_BLOCK_RESOURCES`` one.
+
+        The tabs of a browser (see ``WEBDRIVER_TABS``) navigate concurrently
+        through its proxy, so they all follow the default spec.
+
+        """
+        spec = request.meta.get('webdriver_block_resources')
+        if request.manager._browser is not None:
+            if spec is not None and not self._warned_tabs:
+                self._warned_tabs = True
+                log.msg('The webdriver_block_resources meta key is ignored '
+                        'with WEBDRIVER_TABS', level=log.WARNING)
+            return
+        proxy = vars(request.manager.webdriver).get('_blocking_proxy')
+        if proxy is not None:
+            proxy.use(spec)
+
+    def _strategy(self, request):
+        """Return the page load strategy of the request."""
+        return request.meta.get('webdriver_page_load_strategy',
+                                self._page_load_strategy)
+
+    def _navigate(self, request):
+        """Load the request's page, following its page load strategy.
+
+        The strategy of the session is set with
+        ``WEBDRIVER_PAGE_LOAD_STRATEGY``, and requests can ask for another one
+        in the ``webdriver_page_load_strategy`` meta key. Waiting for a page to
+        be more loaded than the session does is done after ``get``. Waiting
+        less is emulated by navigating from a script, which some drivers wait
+        on anyway. Pages that are only scrolled to a fragment of the current
+        one are never left, and are loaded with ``get``.
+
+        """
+        webdriver = request.manager.webdriver
+        strategy = self._strategy(request)
+        if (strategy == self._page_load_strategy or
+                _same_document(webdriver, request.url)):
+            return webdriver.get(request.url)
+        if STRATEGIES.index(strategy) > \
+                STRATEGIES.index(self._page_load_strategy):
+            webdriver.get(request.url)
+        else:
+            webdriver.execute_script(NAVIGATE, request.url)
+        timeout = timeouts(webdriver).get('page load',
+                                          self._page_load_timeout)
+        # pages being navigated away from may fail scripts
+        wait = WebDriverWait(webdriver, timeout, 0.05,
+                             ignored_exceptions=(WebDriverException,))
+        wait.until(lambda webdriver: webdriver.execute_script(NAVIGATED,
+                                                              strategy))
+
+    def _wait_until(self, request, spider):
+        """Wait for the page to satisfy the request's ``wait_until`` spec.
+
+        The conditions are evaluated in the browser by a single asynchronous
+        script, which gives up after the spec's ``timeout`` or
+        ``WEBDRIVER_WAIT_TIMEOUT`` seconds. The page is returned either way.
+
+        """
+        spec = request.meta.get('webdriver_wait_until')
+        if not spec:
+            return
+        timeout = spec.get('timeout', self._wait_timeout)
+        try:
+            # leave the script time to give up on its own
+            request.manager.extend_script_timeout(timeout + 1)
+            ready = request.manager.webdriver.execute_async_script(
+                WAIT_UNTIL, spec, timeout * 1000)
+        except Exception, exception:
+            msg = 'Error while waiting for %s with webdriver (%s)' % \
+                (request.url, exception)
+            spider.log(msg, level=log.ERROR)
+        else:
+            self._log_not_ready(request, ready, spider)
+
+    def _log_not_ready(self, request, ready, spider):
+        if not ready:
+            spider.log('Gave up waiting for %s to satisfy %r' %
+                       (request.url, request.meta['webdriver_wait_until']),
+                       level=log.WARNING)
+
+    def _response(self, request, url, exception=None):
+        """Return the response for a request that holds a webdriver lease.
+
+        In snapshot mode (``WEBDRIVER_SNAPSHOT`` or the ``webdriver_snapshot``
+        request meta key), the page source is captured right away, and the
+        lease is released so that the webdriver instance can move on to the
+        next request while the callback parses the detached response.
+
+        Live responses get ``CompiledActionChains`` with
+        ``WEBDRIVER_COMPILED_ACTIONS`` or the ``webdriver_compiled_actions``
+        request meta key.
+
+        With ``WEBDRIVER_COMMAND_STATS``, the response gets the ``CommandLog``
+        of its lease, where the commands issued from then on are counted as
+        the callback's.
+
+        """
+        webdriver = request.manager.webdriver
+        commands = request.manager.commands
+        snapshot = request.meta.get('webdriver_snapshot', self._snapshot)
+        started = time()
+        try:
+            if not snapshot:
+                compiled = request.meta.get('webdriver_compiled_actions',
+                                            self._compiled_actions)
+                response = WebdriverResponse(url, webdriver, exception,
+                                             compiled_actions=compiled)
+            elif exception:
+                response = WebdriverResponse(url, None, exception)
+            else:
+                response = WebdriverResponse(url, None,
+                                             body=webdriver.page_source)
+            if not exception:
+                self._record_page_source(request, response, started)
+                if not snapshot:
+                    # the next page loads while the callback parses this one
+                    request.manager.prefetch_next(request)
+        finally:
+            if snapshot:
+                request.manager.manager.release(request)
+        response.commands = commands
+        if commands is not None:
+            commands.phase = 'callback'
+        return response
+
+    def _record_page_source(self, request, response, started):
+        request.manager.record_timing('page_source', time() - started)
+        request.manager.record_size('page_source', len(response.body))
+
+
+def _same_document(webdriver, url):
+    """Return whether the URL is a fragment of the current page."""
+    if '#' not in url:
+        return False
+    return urldefrag(webdriver.current_url)[0] == urldefrag(url)[0]
+
+
+def _flag_escalated(response):
+    """Flag the response of a static-first request escalated to webdriver.
+
+    The flag is on the response rather than in the request meta, which the
+    requests built from the response may inherit.
+
+    """
+    response.flags.append('webdriver_escalated')
+    return response
@@ -1,18 +1,39 @@
 from scrapy.http import Request, TextResponse
 from selenium.webdriver.common.action_chains import ActionChains
 
+from .action_chains import CompiledActionChains
+from .selector import WebdriverSnapshotSelector
+from .wait import check_spec
+
 
 class WebdriverRequest(Request):
-    """A Request needed when using the webdriver download handler."""
+    """A Request needed when using the webdriver download handler.
+
+    The page is returned as soon as it is loaded, unless a ``wait_until`` spec
+    is given (see ``scrapy_webdriver.wait.check_spec``). It is kept in the
+    ``webdriver_wait_until`` meta key, and evaluated in the browser once the
+    page is loaded, or once in-page actions are performed.
+
+    ``holds_lease`` tells whether the request was leased its ``manager``
+    instance, and has yet to give it back. It is kept by the copies of the
+    request, like those of the retry and redirect middlewares.
+
+    """
     WAITING = None
 
-    def __init__(self, url, manager=None, **kwargs):
+    def __init__(self, url, manager=None, wait_until=None, **kwargs):
         super(WebdriverRequest, self).__init__(url, **kwargs)
         self.manager = manager
+        self.holds_lease = False
+        if wait_until is not None:
+            check_spec(wait_until)
+            self.meta['webdriver_wait_until'] = wait_until
 
     def replace(self, *args, **kwargs):
         kwargs.setdefault('manager', self.manager)
-        return super(WebdriverRequest, self).replace(*args, **kwargs)
+        request = super(WebdriverRequest, self).replace(*args, **kwargs)
+        request.holds_lease = self.holds_lease
+        return request
 
 
 class WebdriverActionRequest(WebdriverRequest):
@@ -37,21 +58,52 @@ class WebdriverActionRequest(WebdriverRequest):
 
 
 class WebdriverResponse(TextResponse):
-    """A Response that will feed the webdriver page into its body."""
-    def __init__(self, url, webdriver, exception=None, **kwargs):
+    """A Response that will feed the webdriver page into its body.
+
+    A response created without a webdriver is detached: it only carries the
+    page source it was given as body, and holds no lease on any webdriver
+    instance.
+
+    With ``compiled_actions``, the ``actions`` of the response are
+    ``CompiledActionChains``, that run in the page in as few round trips as
+    possible.
+
+    With ``WEBDRIVER_COMMAND_STATS``, ``commands`` is the ``CommandLog`` of
+    the WebDriver commands issued for the request and its callback.
+
+    """
+    def __init__(self, url, webdriver, exception=None, compiled_actions=False,
+                 **kwargs):
         # If the response resulted in an exception, the body may not exist
-        if exception:
+        if exception or webdriver is None:
             page_source = '<html><head></head><body></body></html>'
         else:
             page_source = webdriver.page_source
         kwargs.setdefault('body', page_source)
         kwargs.setdefault('encoding', 'utf-8')
         super(WebdriverResponse, self).__init__(url, **kwargs)
-        self.actions = ActionChains(webdriver)
+        chains = CompiledActionChains if compiled_actions else ActionChains
+        self.actions = None if webdriver is None else chains(webdriver)
         self.webdriver = webdriver
         self.exception = exception
+        self.commands = None
+        self._selector = None
+
+    @property
+    def selector(self):
+        """A ``WebdriverSnapshotSelector`` on the captured page source."""
+        if self._selector is None:
+            self._selector = WebdriverSnapshotSelector(self)
+        return self._selector
+
+    @property
+    def detached(self):
+        """Whether the response is detached from the webdriver."""
+        return self.webdriver is None
 
     def action_request(self, **kwargs):
         """Return a Request object to perform the recorded actions."""
+        if self.detached:
+            raise ValueError('Detached responses have no page to act on.')
         kwargs.setdefault('meta', self.meta)
         return WebdriverActionRequest(self, **kwargs)
@@ -0,0 +1,78 @@
+from scrapy import signals
+from scrapy.utils.misc import load_object
+
+from .http import WebdriverResponse
+
+
+class WebdriverHttpCache(object):
+    """Caches rendered pages, so that they can be replayed without a browser.
+
+    The page source of webdriver responses is stored with the stock scrapy
+    cache storages (``HTTPCACHE_STORAGE``), which handle the expiration of
+    cached pages (``HTTPCACHE_EXPIRATION_SECS``). Whether a page is cached, and
+    whether a cached page is still fresh, is decided by a scrapy cache policy
+    (``WEBDRIVER_HTTPCACHE_POLICY``, defaulting to ``HTTPCACHE_POLICY``).
+
+    Cached pages are replayed as detached responses.
+
+    """
+    def __init__(self, crawler):
+        settings = crawler.settings
+        policy = settings.get('WEBDRIVER_HTTPCACHE_POLICY',
+                              settings['HTTPCACHE_POLICY'])
+        storage = settings.get('WEBDRIVER_HTTPCACHE_STORAGE',
+                               settings['HTTPCACHE_STORAGE'])
+        self.policy = load_object(policy)(settings)
+        self.storage = load_object(storage)(settings)
+        self.stats = crawler.stats
+        crawler.signals.connect(self.spider_opened,
+                                signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed,
+                                signal=signals.spider_closed)
+
+    def spider_opened(self, spider):
+        self.storage.open_spider(spider)
+
+    def spider_closed(self, spider):
+        self.storage.close_spider(spider)
+
+    def is_cached(self, spider, request):
+        """Return whether the page of the request is cached and fresh."""
+        if not self.policy.should_cache_request(request):
+            return False
+        cachedresponse = self.storage.retrieve_response(spider, request)
+        if cachedresponse is None:
+            self.stats.inc_value('webdriver/httpcache/miss', spider=spider)
+            return False
+        if not self.policy.is_cached_response_fresh(cachedresponse, request):
+            self.stats.inc_value('webdriver/httpcache/stale', spider=spider)
+            return False
+        return True
+
+    def retrieve_response(self, spider, request):
+        """Return a detached response for the request if cached and fresh."""
+        if not self.policy.should_cache_request(request):
+            return
+        cachedresponse = self.storage.retrieve_response(spider, request)
+        if (cachedresponse is None or
+                not self.policy.is_cached_response_fresh(cachedresponse,
+                                                         request)):
+            return
+        self.stats.inc_value('webdriver/httpcache/hit', spider=spider)
+        return WebdriverResponse(cachedresponse.url, None,
+                                 body=cachedresponse.body,
+                                 status=cachedresponse.status,
+                                 headers=cachedresponse.headers,
+                                 flags=['webdriver_cached'])
+
+    def store_response(self, spider, request, response):
+        """Store the page source of a webdriver response, if cacheable."""
+        if response.exception is not None:
+            return
+        if (self.policy.should_cache_request(request) and
+                self.policy.should_cache_response(response, request)):
+            self.stats.inc_value('webdriver/httpcache/store', spider=spider)
+            self.storage.store_response(spider, request, response)
+        else:
+            self.stats.inc_value('webdriver/httpcache/uncacheable',
+                                 spider=spider)
@@ -1,32 +1,536 @@
 import copy
 import inspect
-from collections import deque
-from threading import Lock
+import os
+import shutil
+import tempfile
+from collections import defaultdict, deque
+from glob import glob
+from threading import Lock, RLock
+from time import time
 
-from scrapy.signals import engine_stopped
+from scrapy import log
+from scrapy.signals import (engine_started, engine_stopped, spider_closed,
+                            spider_opened)
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.job import job_dir
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadable import isInIOThread
 from scrapy_webdriver.http import WebdriverRequest, WebdriverActionRequest
+from scrapy_webdriver.httpcache import WebdriverHttpCache
+from scrapy_webdriver.proxy import BlockingProxy, BlockRules
+from scrapy_webdriver.queues import DiskSpillWaitQueue, PriorityWaitQueue
+from scrapy_webdriver.stats import (COUNT_BOUNDS, SIZE_BOUNDS, TIME_BOUNDS,
+                                    CommandLog, count_commands,
+                                    record_histogram, record_percentiles)
+from scrapy_webdriver.timeline import TimelineWriter
+from scrapy_webdriver.wait import (NAVIGATE, NAVIGATED, extend_script_timeout,
+                                   timeouts)
+from scrapy_webdriver.wire import WebdriverClient
 from selenium import webdriver
+from selenium.webdriver.common.proxy import Proxy, ProxyType
+from selenium.webdriver.remote.switch_to import SwitchTo
+from selenium.webdriver.support.ui import WebDriverWait
+
+
+class WebdriverInstance(object):
+    """A single webdriver instance of the manager's pool.
+
+    An instance is leased to one request at a time. The leased instance is
+    set as the ``manager`` attribute of the request, so that the download
+    handler and in-page requests can get back to the right browser.
+
+    """
+    def __init__(self, manager, webdriver=None, browser=None):
+        self.manager = manager
+        self._browser = browser
+        self._lock = Lock()
+        self._webdriver = webdriver
+        self._session = None
+        self._wait_inpage_queue = PriorityWaitQueue(manager._queue_aging)
+        self._leases = 0
+        self._started = time()
+        self._leased_at = None
+        self._url = None
+        self.commands = None
+        self._recycle = None
+        self._host = None
+        self._pages = 0
+        self._prefetched = None
+        self._prefetch_url = None
+        self._prefetch_handle = None
+
+    @property
+    def webdriver(self):
+        """Return the webdriver instance, instantiate it if necessary.
+
+        This is also where an instance due for recycling gets restarted, at
+        the beginning of its next lease.
+
+        """
+        if self._recycle is not None:
+            self._restart()
+        if self._webdriver is None:
+            self.reconnect()
+        return self._webdriver
+
+    def reconnect(self):
+        """Connect to a new instance of the webdriver
+
+        The manager's hot spare is used if there is one ready. Instances
+        sharing a browser (see ``WEBDRIVER_TABS``) open a new tab instead.
+
+        """
+        started = time()
+        kind = 'connect' if self._webdriver is None else 'reconnect'
+        if self._browser is not None:
+            if self._webdriver is not None:
+                try:
+                    self._webdriver.quit()  # only closes the tab
+                except Exception:
+                    pass
+            _webdriver = self._browser.open_tab()
+        else:
+            if self._webdriver is not None:
+                self.manager._stop_proxy(self._webdriver)
+            _webdriver = self.manager._take_spare()
+            if _webdriver is None:
+                _webdriver = self.manager._connect()
+        if self.manager._command_stats:
+            count_commands(_webdriver, self)
+        self._webdriver = _webdriver
+        self._prefetch_handle = None
+        self._leases = 0
+        self._started = time()
+        self.record_timing(kind, self._started - started)
+        return self._webdriver
+
+    def _restart(self):
+        """Quit the webdriver or session due for recycling."""
+        self.manager._log_recycle(self, self._recycle)
+        self._recycle = None
+        if self._session is not None:
+            self.drop_session()
+        _webdriver, self._webdriver = self._webdriver, None
+        if _webdriver is not None:
+            if self._browser is None:
+                self.manager._stop_proxy(_webdriver)
+            try:
+                _webdriver.quit()
+            except Exception, exception:
+                log.msg('Error while quitting a webdriver (%s)' % exception,
+                        level=log.DEBUG)
+
+    def session(self):
+        """Return a deferred fired with the wire protocol session.
+
+        Only available with the ``twisted`` webdriver backend, the session is
+        created if necessary.
+
+        """
+        if self._recycle is not None:
+            self._restart()
+        if self._session is not None:
+            return defer.succeed(self._session)
+        dfd = self.manager._connect_session()
+        dfd.addCallback(self._set_session)
+        return dfd
+
+    def _set_session(self, session):
+        self._session = session
+        self._leases = 0
+        self._started = time()
+        return session
+
+    def drop_session(self):
+        """Forget about the current session, after telling it to quit."""
+        session, self._session = self._session, None
+        if session is not None:
+            session.quit().addErrback(lambda failure: None)
+
+    def prefetch(self, url):
+        """Start loading a page in a background tab, without waiting for it.
+
+        See ``switch_to_prefetched``.
+
+        """
+        _webdriver = self.webdriver
+        main = _webdriver.current_window_handle
+        if self._prefetch_handle not in _webdriver.window_handles:
+            self._prefetch_handle = _open_window(_webdriver)
+        _webdriver.switch_to.window(self._prefetch_handle)
+        try:
+            _webdriver.execute_script(NAVIGATE, url)
+            self._prefetch_url = url
+        finally:
+            _webdriver.switch_to.window(main)
+
+    def switch_to_prefetched(self, url, strategy='normal'):
+        """Switch to the background tab, if it is loading the given URL.
+
+        The background tab and the current one swap places, and the page is
+        waited for until it reaches the page load strategy, for no longer than
+        the page load timeout last set. Return whether the page was
+        prefetched.
+
+        """
+        prefetched, self._prefetch_url = self._prefetch_url, None
+        _webdriver = self.webdriver
+        if prefetched != url or self._prefetch_handle is None:
+            return False
+        main = _webdriver.current_window_handle
+        _webdriver.switch_to.window(self._prefetch_handle)
+        self._prefetch_handle = main
+        timeout = timeouts(_webdriver).get('page load') or 300
+        WebDriverWait(_webdriver, timeout, 0.1).until(
+            lambda _webdriver: _webdriver.execute_script(NAVIGATED,
+                                                         strategy))
+        return True
+
+    def prefetch_next(self, request):
+        """Start loading the next waiting page, for while the request's
+        callback parses its response.
+
+        With ``WEBDRIVER_PREFETCH``, the next request of the queue is given to
+        this instance, and its page is loaded in a background tab. It is the
+        next request this instance serves, after the in-page requests yielded
+        by the callback if any. With ``WEBDRIVER_BLOCK_RESOURCES``, that is
+        only if the next request blocks the same resources as the current
+        one, whose rules the browser's proxy follows.
+
+        This is called from the download thread, before the response is
+        returned, so that the browser is never driven from the reactor
+        thread. Only the queue is handled in the reactor thread.
+
+        """
+        if not self.manager._prefetch:
+            return
+        block = request.meta.get('webdriver_block_resources')
+        next_request = _call_in_reactor(self.manager._reserve_prefetch, self,
+                                        block)
+        if next_request is None:
+            return
+        try:
+            self.prefetch(next_request.url)
+        except Exception, exception:
+            log.msg('Error while prefetching %s with webdriver (%s)' %
+                    (next_request.url, exception), level=log.DEBUG)
+            _call_in_reactor(self.manager._cancel_prefetch, self,
+                             next_request)
+            return
+        self.manager.crawler.stats.inc_value('webdriver/prefetched')
+
+    def extend_script_timeout(self, seconds):
+        """Make sure that asynchronous scripts may run for that long."""
+        extend_script_timeout(self.webdriver, seconds)
+
+    def record_timing(self, name, seconds):
+        """Record a timing of the render path, see ``WebdriverManager``.
+
+        With ``WEBDRIVER_TRACE_FILE``, the timing is also written as a span
+        that just ended, on the timeline of this instance.
+
+        """
+        self.manager.record_timing(name, seconds)
+        if self.manager.timeline is not None:
+            self.manager.timeline.span(self, name, seconds, self._url)
+
+    def record_size(self, name, size):
+        """Record a size of the render path, see ``WebdriverManager``."""
+        self.manager.record_size(name, size)
+
+    def acquire(self):
+        """Try to lease this instance, return whether it succeeded."""
+        if not self._lock.acquire(False):
+            return False
+        self._leased_at = time()
+        return True
+
+    @property
+    def leased(self):
+        """Return whether this instance is leased to a request."""
+        return self._lock.locked()
+
+    def release(self):
+        """Release the lease on this instance.
+
+        The instance is marked for recycling if the manager's recycling
+        policy says so, unless in-page requests still need its current page.
+
+        """
+        self._leases += 1
+        if not self._wait_inpage_queue:
+            self._recycle = self.manager._recycle_reason(self)
+        if self._leased_at is not None:
+            self.record_timing('lease', time() - self._leased_at)
+        commands, self.commands = self.commands, None
+        if commands is not None:
+            self.manager._record_commands(commands)
+        if self.manager.timeline is not None:
+            self.manager.timeline.released(self, self._url)
+        self._url = None
+        self._lock.release()
+
+    def rss(self):
+        """Return the resident memory of the browser's processes, in bytes.
+
+        Return ``None`` if the browser processes are unknown, like for remote
+        webdrivers.
+
+        """
+        try:
+            pid = self._webdriver.service.process.pid
+        except AttributeError:
+            return None
+        return _process_tree_rss(pid)
+
+
+class WebdriverBrowser(object):
+    """A browser shared by several instances of the pool, one tab each.
+
+    Each instance gets a copy of the webdriver that switches to the window
+    handle of its tab before every command. The commands of all the tabs go
+    through the same browser session, so they are serialized, but a page left
+    open in a tab by a leased instance doesn't keep the other tabs from
+    navigating.
+
+    """
+    def __init__(self, manager):
+        self.manager = manager
+        self._lock = RLock()
+        self._webdriver = None
+        self._current = None
+
+    def open_tab(self):
+        """Return the webdriver of a new tab.
+
+        The browser is launched if necessary, and launched anew if it doesn't
+        respond anymore, which leaves the other tabs broken until they
+        reconnect themselves.
+
+        """
+        with self._lock:
+            if self._webdriver is not None:
+                try:
+                    return self._tab(self._new_window())
+                except Exception, exception:
+                    log.msg('Relaunching a webdriver browser (%s)' % exception,
+                            level=log.DEBUG)
+                    self.quit()
+            self._webdriver = self.manager._connect()
+            self._current = self._webdriver.current_window_handle
+            return self._tab(self._current)
+
+    def quit(self):
+        """Quit the browser, closing all its tabs."""
+        with self._lock:
+            _webdriver, self._webdriver = self._webdriver, None
+            self._current = None
+            if _webdriver is not None:
+                self.manager._stop_proxy(_webdriver)
+                try:
+                    _webdriver.quit()
+                except Exception, exception:
+                    log.msg('Error while quitting a webdriver (%s)' %
+                            exception, level=log.DEBUG)
+
+    def _new_window(self):
+        # The window we are switched to may have been closed.
+        self._switch(self._webdriver.window_handles[0])
+        return _open_window(self._webdriver)
+
+    def _switch(self, handle):
+        if self._current != handle:
+            self._webdriver.switch_to.window(handle)
+            self._current = handle
+
+    def _tab(self, handle):
+        """Return a copy of the webdriver, bound to the given window."""
+        tab = copy.copy(self._webdriver)
+        execute = tab.execute  # elements found get the tab as parent
+
+        def switching_execute(driver_command, params=None):
+            with self._lock:
+                self._switch(handle)
+                return execute(driver_command, params)
+
+        def close():
+            """Close the tab, the browser is left running."""
+            with self._lock:
+                tab.close()
+                self._current = None
+
+        tab.execute = switching_execute
+        tab.quit = close
+        tab._switch_to = SwitchTo(tab)
+        tab.window_handle = handle
+        return tab
+
+
+def _call_in_reactor(f, *args):
+    """Call f in the reactor thread, and return its result."""
+    if not reactor.running or isInIOThread():
+        return f(*args)
+    return threads.blockingCallFromThread(reactor, f, *args)
+
+
+def _open_window(_webdriver):
+    """Open a new blank window, return its handle."""
+    handles = _webdriver.window_handles
+    _webdriver.execute_script('window.open("about:blank");')
+    handle, = set(_webdriver.window_handles) - set(handles)
+    return handle
+
+
+def _process_tree_rss(pid):
+    """Return the resident memory of a process and its descendants, in bytes.
+
+    This reads from /proc, so it is only supported on Linux. The tree is
+    walked through the ``children`` files of the processes, or found by
+    scanning all the processes on kernels without them.
+
+    """
+    if os.path.exists('/proc/%d/task/%d/children' % (pid, pid)):
+        children = _children
+    else:
+        children = _scan_children().__getitem__
+    total, pids = 0, [pid]
+    while pids:
+        pid = pids.pop()
+        total += _rss_pages(pid)
+        pids.extend(children(pid))
+    return total * os.sysconf('SC_PAGE_SIZE')
+
+
+def _children(pid):
+    """Return the child processes of a process."""
+    pids = []
+    for path in glob('/proc/%d/task/*/children' % pid):
+        try:
+            with open(path) as children:
+                pids.extend(int(child) for child in children.read().split())
+        except IOError:
+            continue
+    return pids
+
+
+def _scan_children():
+    """Return the child processes of all the processes, by parent."""
+    children = defaultdict(list)
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as stat:
+                # Skip the command name, which may contain spaces.
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except (IOError, IndexError):
+            continue
+        children[int(fields[1])].append(int(entry))
+    return children
+
+
+def _rss_pages(pid):
+    """Return the resident memory of a process, in pages."""
+    try:
+        with open('/proc/%d/statm' % pid) as statm:
+            return int(statm.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return 0
 
 
 class WebdriverManager(object):
-    """Manages the life cycle of a webdriver instance."""
+    """Manages the life cycle of a pool of webdriver instances."""
     USER_AGENT_KEY = 'phantomjs.page.settings.userAgent'
 
     def __init__(self, crawler):
         self.crawler = crawler
-        self._lock = Lock()
-        self._wait_queue = deque()
-        self._wait_inpage_queue = deque()
+        self._queue_aging = crawler.settings.getfloat('WEBDRIVER_QUEUE_AGING',
+                                                      0)
+        self._wait_queue = PriorityWaitQueue(self._queue_aging)
+        self._wait_deferreds = deque()
+        self._queue_memory_limit = crawler.settings.getint(
+            'WEBDRIVER_QUEUE_MEMORY_LIMIT', 0)
+        self._jobdir = job_dir(crawler.settings)
+        if self._jobdir or self._queue_memory_limit:
+            crawler.signals.connect(self._spider_opened, signal=spider_opened)
+            crawler.signals.connect(self._spider_closed, signal=spider_closed)
+        crawler.signals.connect(self._record_percentiles,
+                                signal=spider_closed)
+        self.timeline = None
+        trace_file = crawler.settings.get('WEBDRIVER_TRACE_FILE', None)
+        if trace_file:
+            self.timeline = TimelineWriter(trace_file)
+            crawler.signals.connect(self.timeline.close,
+                                    signal=spider_closed)
+        # shared by the spider middleware and the download handler
+        self.cache = None
+        if crawler.settings.getbool('WEBDRIVER_HTTPCACHE_ENABLED'):
+            self.cache = WebdriverHttpCache(crawler)
         self._browser = crawler.settings.get('WEBDRIVER_BROWSER', None)
-        self._browser_name = crawler.settings.get('WEBDRIVER_BROWSER', None)
         self._remote_webdriver = crawler.settings.get('REMOTE_WEBDRIVER', None)
         self._implicit_wait = crawler.settings.get('WEBDRIVER_IMPLICIT_WAIT', 0)
         timeout = crawler.settings.get('WEBDRIVER_TIMEOUT', None)
         self._page_load_timeout = crawler.settings.get( 'WEBDRIVER_PAGE_LOAD_TIMEOUT', timeout)
         self._script_timeout = crawler.settings.get( 'WEBDRIVER_SCRIPT_TIMEOUT', timeout)
+        self._page_load_strategy = crawler.settings.get(
+            'WEBDRIVER_PAGE_LOAD_STRATEGY', None)
+        self._command_budget = crawler.settings.getint(
+            'WEBDRIVER_COMMAND_BUDGET', 0)
+        self._command_stats = crawler.settings.getbool(
+            'WEBDRIVER_COMMAND_STATS', bool(self._command_budget))
+        self._block_resources = crawler.settings.get(
+            'WEBDRIVER_BLOCK_RESOURCES', None)
+        if self._block_resources:
+            if self._remote_webdriver:
+                raise ValueError('WEBDRIVER_BLOCK_RESOURCES needs the browser '
+                                 'to run locally, not a REMOTE_WEBDRIVER.')
+            BlockRules(self._block_resources)  # fail early on a bad spec
         self._user_agent = crawler.settings.get('USER_AGENT', None)
         self._options = crawler.settings.get('WEBDRIVER_OPTIONS', dict())
-        self._webdriver = None
+        self.backend = crawler.settings.get('WEBDRIVER_BACKEND', 'selenium')
+        if self.backend not in ('selenium', 'twisted'):
+            raise ValueError('Unknown WEBDRIVER_BACKEND %r.' % self.backend)
+        self._client = None
+        if self.backend == 'twisted':
+            if not self._remote_webdriver:
+                raise ValueError('The twisted WEBDRIVER_BACKEND needs a '
+                                 'REMOTE_WEBDRIVER.')
+            self._client = WebdriverClient(self._remote_webdriver + 'wd/hub')
+        self._prewarm = crawler.settings.getbool('WEBDRIVER_PREWARM', False)
+        self._hot_spare = crawler.settings.getbool('WEBDRIVER_HOT_SPARE',
+                                                   False)
+        self._recycle_pages = crawler.settings.getint('WEBDRIVER_RECYCLE_PAGES',
+                                                      0)
+        self._recycle_secs = crawler.settings.getint('WEBDRIVER_RECYCLE_SECS',
+                                                     0)
+        self._recycle_memory = crawler.settings.getint(
+            'WEBDRIVER_RECYCLE_MEMORY_MB', 0) * 1024 * 1024
+        self._affinity = crawler.settings.getbool('WEBDRIVER_DOMAIN_AFFINITY',
+                                                  True)
+        self._affinity_imbalance = crawler.settings.getint(
+            'WEBDRIVER_AFFINITY_IMBALANCE', 10)
+        tabs = crawler.settings.getint('WEBDRIVER_TABS', 1)
+        if tabs < 1:
+            raise ValueError('WEBDRIVER_TABS must be at least 1.')
+        self._prefetch = crawler.settings.getbool('WEBDRIVER_PREFETCH', False)
+        if self._prefetch and tabs > 1:
+            raise ValueError('WEBDRIVER_PREFETCH needs WEBDRIVER_TABS to be 1.')
+        if tabs > 1 and self.backend != 'selenium':
+            raise ValueError('WEBDRIVER_TABS needs the selenium '
+                             'WEBDRIVER_BACKEND.')
+        # Recycling a tab would only close it, the shared browser would never
+        # be restarted.
+        if tabs > 1 and (self._recycle_pages or self._recycle_secs or
+                         self._recycle_memory):
+            raise ValueError('WEBDRIVER_RECYCLE_* settings need '
+                             'WEBDRIVER_TABS to be 1.')
+        self._spare = None
+        self._spare_lock = Lock()
+        self._spare_launching = False
+        pool_size = crawler.settings.getint('WEBDRIVER_POOL_SIZE', 1)
+        if pool_size < 1:
+            raise ValueError('WEBDRIVER_POOL_SIZE must be at least 1.')
+        _webdriver = None
         if isinstance(self._browser, basestring):
             if '.' in self._browser:
                 module, browser = self._browser.rsplit('.', 2)
@@ -37,24 +541,64 @@ class WebdriverManager(object):
         elif inspect.isclass(self._browser):
             self._browser = self._browser
         else:
-            self._webdriver = self._browser
+            # An already instantiated webdriver can't be cloned into a pool.
+            if pool_size > 1:
+                raise ValueError('WEBDRIVER_POOL_SIZE must be 1 when '
+                                 'WEBDRIVER_BROWSER is a webdriver instance.')
+            _webdriver = self._browser
+        self._browsers = []
+        if tabs > 1 and _webdriver is None:
+            # Each browser gets up to WEBDRIVER_TABS instances of the pool.
+            self._browsers = [WebdriverBrowser(self)
+                              for _ in xrange(0, pool_size, tabs)]
+            self._instances = [WebdriverInstance(self, browser=browser)
+                               for browser in self._browsers
+                               for _ in xrange(tabs)][:pool_size]
+        else:
+            self._instances = [WebdriverInstance(self, _webdriver)]
+            self._instances.extend(WebdriverInstance(self)
+                                   for _ in xrange(pool_size - 1))
+        if self._prewarm or self._hot_spare:
+            crawler.signals.connect(self._engine_started,
+                                    signal=engine_started)
 
     @property
     def _desired_capabilities(self):
         capabilities = dict()
         if self._user_agent is not None:
             capabilities[self.USER_AGENT_KEY] = self._user_agent
+        if self._page_load_strategy is not None:
+            capabilities['pageLoadStrategy'] = self._page_load_strategy
         return capabilities or None
 
+    @property
+    def _browser_name(self):
+        """Return the ``browserName`` of remote browsers, after the
+        ``WEBDRIVER_BROWSER`` class, whether given by name or not.
+
+        The selenium webdriver classes are all named ``WebDriver``, and are
+        told apart by their package, like ``selenium.webdriver.chrome``.
+
+        """
+        browser = self._browser
+        if not inspect.isclass(browser):
+            browser = type(browser)
+        if browser.__module__.startswith('selenium.webdriver.'):
+            return browser.__module__.split('.')[2]
+        return browser.__name__.lower()
+
     @property
     def webdriver(self):
-        """Return the webdriver instance, instantiate it if necessary."""
-        if self._webdriver is None:
-            self.reconnect()
-        return self._webdriver
+        """Return the first webdriver instance of the pool.
 
-    def reconnect(self):
-        """Connect to a new instance of the webdriver"""
+        Only meaningful when ``WEBDRIVER_POOL_SIZE`` is 1, otherwise use the
+        ``manager`` attribute of a request to get to its leased instance.
+
+        """
+        return self._instances[0].webdriver
+
+    def _connect(self):
+        """Return a new webdriver, configured from the crawler settings."""
         short_arg_classes = (webdriver.Firefox, webdriver.Ie)
         if issubclass(self._browser, short_arg_classes):
             cap_attr = 'capabilities'
@@ -62,64 +606,444 @@ class WebdriverManager(object):
             cap_attr = 'desired_capabilities'
         options = copy.deepcopy(self._options)
         options[cap_attr] = self._desired_capabilities
-        
-        browser = self._browser_name.lower()
+        proxy = None
+        if self._block_resources and not self._remote_webdriver:
+            proxy = BlockingProxy(self._block_resources, self.crawler.stats)
+            address = '127.0.0.1:%d' % _call_in_reactor(proxy.listen)
+            capabilities = options[cap_attr] = dict(options[cap_attr] or {})
+            Proxy({'proxyType': ProxyType.MANUAL, 'httpProxy': address,
+                   'sslProxy': address}).add_to_capabilities(capabilities)
 
         if not self._remote_webdriver:
-            self._webdriver = self._browser(**options)
+            _webdriver = self._browser(**options)
         else:
             #TODO: need to figure out how to pass in the browser options
-            self._webdriver = webdriver.Remote(command_executor=self._remote_webdriver+"wd/hub",desired_capabilities={ "browserName": browser })
+            capabilities = {"browserName": self._browser_name}
+            if self._page_load_strategy is not None:
+                capabilities['pageLoadStrategy'] = self._page_load_strategy
+            _webdriver = webdriver.Remote(command_executor=self._remote_webdriver+"wd/hub",desired_capabilities=capabilities)
         # Set the following timeout related settings on the webdriver:
         # * the amount of seconds to wait when an element cannot be found.
         # * the amount of seconds to wait for a page to load.
         # * the amount of seconds to wait for a script to execute.
         # For a more detailed explanation of these settings, please refer to
         # the Selenium documentation.
-        self._webdriver.implicitly_wait(self._implicit_wait)
+        if proxy is not None:
+            _webdriver._blocking_proxy = proxy
+        _webdriver.implicitly_wait(self._implicit_wait)
+        set_timeouts = timeouts(_webdriver)
         if self._script_timeout:
-            self._webdriver.set_script_timeout(self._script_timeout)
+            _webdriver.set_script_timeout(self._script_timeout)
+            set_timeouts['script'] = self._script_timeout
         if self._page_load_timeout:
-            self._webdriver.set_page_load_timeout(self._page_load_timeout)
+            _webdriver.set_page_load_timeout(self._page_load_timeout)
+            set_timeouts['page load'] = self._page_load_timeout
         self.crawler.signals.connect(self._cleanup, signal=engine_stopped)
-        return self._webdriver
+        return _webdriver
+
+    def _stop_proxy(self, _webdriver):
+        """Stop the blocking proxy of a webdriver, if it has one.
+
+        This can be called from any thread.
+
+        """
+        proxy = vars(_webdriver).get('_blocking_proxy')
+        if proxy is not None:
+            reactor.callFromThread(proxy.stop)
+
+    def _engine_started(self):
+        """Launch the webdriver instances before the first requests need them.
+
+        With ``WEBDRIVER_PREWARM``, all the instances of the pool are launched
+        in parallel, and the engine waits for them before starting. With
+        ``WEBDRIVER_HOT_SPARE``, a spare webdriver is launched in the
+        background, to be swapped in when an instance reconnects. Instances
+        sharing browsers (see ``WEBDRIVER_TABS``) reconnect with a new tab,
+        and don't get one.
+
+        """
+        launching = []
+        if self._prewarm:
+            for instance in self._instances:
+                if self.backend == 'twisted':
+                    dfd = instance.session()
+                elif instance._webdriver is None:
+                    dfd = threads.deferToThread(instance.reconnect)
+                else:
+                    continue
+                dfd.addErrback(self._log_launch_failure)
+                launching.append(dfd)
+        if (self._hot_spare and self.backend == 'selenium' and
+                not self._browsers):
+            self._launch_spare()
+        return defer.DeferredList(launching)
+
+    def _launch_spare(self):
+        """Launch a hot spare webdriver in a thread, unless there is one."""
+        if self._spare is not None or self._spare_launching:
+            return
+        self._spare_launching = True
+        dfd = threads.deferToThread(self._connect)
+        dfd.addCallback(self._set_spare)
+        dfd.addErrback(self._log_launch_failure)
+        dfd.addBoth(self._spare_launched)
+
+    def _set_spare(self, _webdriver):
+        with self._spare_lock:
+            self._spare = _webdriver
+
+    def _spare_launched(self, _):
+        self._spare_launching = False
+
+    def _take_spare(self):
+        """Return the hot spare webdriver, if one is ready.
+
+        This can be called from any thread, a new spare is then launched from
+        the reactor thread.
+
+        """
+        with self._spare_lock:
+            spare, self._spare = self._spare, None
+        if self._hot_spare:
+            reactor.callFromThread(self._launch_spare)
+        return spare
+
+    def _recycle_reason(self, instance):
+        """Return why the instance is due for recycling, if it is.
+
+        Instances are recycled after ``WEBDRIVER_RECYCLE_PAGES`` leases, after
+        running for ``WEBDRIVER_RECYCLE_SECS`` seconds, or when their browser
+        processes use more than ``WEBDRIVER_RECYCLE_MEMORY_MB`` of memory.
+
+        """
+        if self._recycle_pages and instance._leases >= self._recycle_pages:
+            return 'pages'
+        if self._recycle_secs and time() - instance._started >= \
+                self._recycle_secs:
+            return 'age'
+        if self._recycle_memory and instance.rss() > self._recycle_memory:
+            return 'memory'
+
+    def _log_recycle(self, instance, reason):
+        log.msg('Recycling webdriver instance after %d pages (%s)' %
+                (instance._leases, reason), level=log.DEBUG)
+        self.crawler.stats.inc_value('webdriver/recycled/%s' % reason)
+
+    def _spider_opened(self, spider):
+        """Move the queue of new page requests to disk.
+
+        Past ``WEBDRIVER_QUEUE_MEMORY_LIMIT`` waiting requests, new ones are
+        spilled to disk, see ``DiskSpillWaitQueue``. The queue lives in the
+        ``JOBDIR`` if there is one, so that the requests left waiting when
+        the crawl is paused are loaded back when it is resumed. Otherwise, it
+        lives in a temporary directory.
+
+        """
+        if self._jobdir:
+            path = os.path.join(self._jobdir, 'webdriver.queue')
+        else:
+            path = tempfile.mkdtemp(prefix='webdriver-queue-')
+        queue = DiskSpillWaitQueue(path, spider, self._queue_memory_limit,
+                                   self._queue_aging)
+        while self._wait_queue:
+            queue.push(self._wait_queue.pop())
+        self._wait_queue = queue
+        if len(queue):
+            log.msg('Resuming crawl (%d webdriver requests waiting)' %
+                    len(queue), spider=spider)
+
+    def _spider_closed(self, spider):
+        """Save the waiting requests to the ``JOBDIR``, or drop the temporary
+        directory of the queue."""
+        if not self._jobdir:
+            shutil.rmtree(self._wait_queue.path, ignore_errors=True)
+            return
+        unsaved = self._wait_queue.close()
+        for request in unsaved:
+            log.msg('Unable to save waiting webdriver request %s' % request,
+                    level=log.WARNING, spider=spider)
+        self._record_queue_depth()
+
+    def _log_launch_failure(self, failure):
+        log.err(failure, 'Error while launching a webdriver instance')
+
+    @defer.inlineCallbacks
+    def _connect_session(self):
+        """Return a deferred fired with a new session on the remote webdriver.
+
+        This is the ``twisted`` backend's counterpart of ``_connect``.
+
+        """
+        capabilities = {'browserName': self._browser_name}
+        if self._page_load_strategy is not None:
+            capabilities['pageLoadStrategy'] = self._page_load_strategy
+        session = yield self._client.new_session(capabilities)
+        if self._implicit_wait:
+            yield session.set_timeout('implicit', self._implicit_wait)
+        if self._script_timeout:
+            yield session.set_timeout('script', self._script_timeout)
+            timeouts(session)['script'] = self._script_timeout
+        if self._page_load_timeout:
+            yield session.set_timeout('page load', self._page_load_timeout)
+            timeouts(session)['page load'] = self._page_load_timeout
+        self.crawler.signals.connect(self._cleanup, signal=engine_stopped)
+        defer.returnValue(session)
 
     def acquire(self, request):
-        """Acquire lock for the request, or enqueue request upon failure."""
+        """Lease a free instance to the request, or enqueue it upon failure.
+
+        In-page requests can only be given the instance their parent page was
+        loaded in, other requests get whichever instance is free.
+
+        """
         assert isinstance(request, WebdriverRequest), \
             'Only a WebdriverRequest can use the webdriver instance.'
-        if self._lock.acquire(False):
-            request.manager = self
-            return request
+        if isinstance(request, WebdriverActionRequest):
+            instance = request.manager
+            if instance.acquire():
+                self._record_acquired(request)
+                return request
+            self._record_waiting(request)
+            instance._wait_inpage_queue.push(request)
+            self._record_queue_depth()
         else:
-            if isinstance(request, WebdriverActionRequest):
-                queue = self._wait_inpage_queue
-            else:
-                queue = self._wait_queue
-            queue.append(request)
+            if self._lease(request):
+                self._record_acquired(request)
+                return request
+            self._record_waiting(request)
+            self._wait_queue.push(request)
+            self._record_queue_depth()
+
+    def acquire_deferred(self, request):
+        """Return a deferred fired with the request once it holds a lease.
+
+        This is for requests that only find out they need a webdriver instance
+        while being downloaded, and can't be enqueued to be yielded again by
+        the spider middleware.
+
+        """
+        if self._lease(request):
+            self._record_acquired(request)
+            return defer.succeed(request)
+        dfd = defer.Deferred()
+        self._record_waiting(request)
+        self._wait_deferreds.append((request, dfd))
+        self._record_queue_depth()
+        return dfd
 
     def acquire_next(self):
-        """Return the next waiting request, if any.
+        """Return the next waiting request that a free instance can take.
 
-        In-page requests are returned first.
+        In-page requests are returned first. Requests waiting on a deferred
+        come next, they are given the instance directly and nothing is
+        returned for them.
 
         """
-        try:
-            request = self._wait_inpage_queue.popleft()
-        except IndexError:
-            try:
-                request = self._wait_queue.popleft()
-            except IndexError:
+        for instance in self._instances:
+            if instance._wait_inpage_queue and instance.acquire():
+                request = instance._wait_inpage_queue.pop()
+                self._record_acquired(request)
+                self._record_queue_depth()
+                return request
+        for instance in self._instances:
+            if instance._prefetched is not None and instance.acquire():
+                request, instance._prefetched = instance._prefetched, None
+                self._record_acquired(request)
+                self._record_queue_depth()
+                return request
+        if not all(instance.leased or instance._prefetched is not None
+                   for instance in self._instances):
+            # Instances are only leased from the reactor thread, so the free
+            # instance is still free when the waiting request gets leased.
+            if self._wait_deferreds:
+                request, dfd = self._wait_deferreds.popleft()
+                self._lease(request)
+                self._record_acquired(request)
+                self._record_queue_depth()
+                dfd.callback(request)
                 return
-        return self.acquire(request)
+            if self._wait_queue:
+                request = self._wait_queue.pop()
+                self._lease(request)
+                self._record_acquired(request)
+                self._record_queue_depth()
+                return request
 
-    def release(self, msg):
-        """Release the the webdriver instance's lock."""
-        self._lock.release()
+    def _lease(self, request):
+        """Lease a free instance to a new page request.
+
+        With ``WEBDRIVER_DOMAIN_AFFINITY``, the instances that last loaded a
+        page from the same host are tried first, their browser cache, cookies
+        and TLS sessions being warm for it. That is unless they already loaded
+        ``WEBDRIVER_AFFINITY_IMBALANCE`` pages more than the least busy
+        instance, in which case the request spills over to the others.
+
+        Return whether an instance was leased.
+
+        """
+        host = urlparse_cached(request).hostname
+        # Instances with a prefetched request are kept for it.
+        instances = [instance for instance in self._instances
+                     if instance._prefetched is None]
+        if not instances:
+            return False
+        if self._affinity and len(self._instances) > 1:
+            least_pages = min(instance._pages for instance in instances)
+            affine = [instance for instance in instances
+                      if instance._host == host and instance._pages -
+                      least_pages < self._affinity_imbalance]
+            others = sorted((instance for instance in instances
+                             if instance not in affine),
+                            key=lambda instance: instance._pages)
+            instances = affine + others
+        for instance in instances:
+            if instance.acquire():
+                break
+        else:
+            return False
+        if self._affinity and len(self._instances) > 1:
+            hit = 'hit' if instance._host == host else 'miss'
+            self.crawler.stats.inc_value('webdriver/affinity/%s' % hit)
+        request.manager = instance
+        instance._host = host
+        instance._pages += 1
+        return True
+
+    def _reserve_prefetch(self, instance, block=None):
+        """Give the next waiting request to an instance, to be prefetched.
+
+        Return the request, or None if there is nothing to prefetch. See
+        ``WebdriverInstance.prefetch_next``.
+
+        """
+        if instance._prefetched is not None or not self._wait_queue:
+            return None
+        if (self._block_resources and self._wait_queue.peek().meta.get(
+                'webdriver_block_resources') != block):
+            return None
+        request = self._wait_queue.pop()
+        request.manager = instance
+        instance._prefetched = request
+        instance._host = urlparse_cached(request).hostname
+        instance._pages += 1
+        return request
+
+    def _cancel_prefetch(self, instance, request):
+        """Put a request that couldn't be prefetched back in the queue."""
+        instance._prefetched = None
+        instance._pages -= 1
+        self._wait_queue.push(request)
+
+    def queue_depth(self):
+        """Return the number of requests waiting for a webdriver instance.
+
+        The numbers are given by kind of request, as a dict with the
+        ``'new'`` (new pages), ``'inpage'`` and ``'deferred'`` (see
+        ``acquire_deferred``) keys.
+
+        """
+        return {
+            'new': len(self._wait_queue) + sum(
+                instance._prefetched is not None
+                for instance in self._instances),
+            'inpage': sum(len(instance._wait_inpage_queue)
+                          for instance in self._instances),
+            'deferred': len(self._wait_deferreds),
+        }
+
+    def record_timing(self, name, seconds):
+        """Record a timing of the render path in the crawler stats.
+
+        Timings are kept as histograms (see ``scrapy_webdriver.stats``) under
+        ``webdriver/timing/<name>``: ``queued`` and ``acquire`` (the time
+        spent waiting for a lease by the requests that waited, and by all of
+        them), ``lease``, ``get``, ``page_source``, ``callback``, and
+        ``connect`` and ``reconnect``.
+
+        """
+        record_histogram(self.crawler.stats, 'webdriver/timing/%s' % name,
+                         seconds, TIME_BOUNDS)
+
+    def record_size(self, name, size):
+        """Record a size in bytes, under ``webdriver/size/<name>``."""
+        record_histogram(self.crawler.stats, 'webdriver/size/%s' % name,
+                         size, SIZE_BOUNDS)
+
+    def _record_percentiles(self, spider):
+        record_percentiles(self.crawler.stats)
+
+    def _record_waiting(self, request):
+        # in the meta, to survive the disk queue
+        request.meta['webdriver_waiting_since'] = time()
+
+    def _record_acquired(self, request):
+        request.holds_lease = True
+        since = request.meta.pop('webdriver_waiting_since', None)
+        waited = 0 if since is None else time() - since
+        if since is not None:
+            self.record_timing('queued', waited)
+        self.record_timing('acquire', waited)
+        request.manager._url = request.url
+        if self.timeline is not None and since is not None:
+            self.timeline.queued(request.url, since)
+        if self._command_stats:
+            callback = getattr(request.callback, '__name__', None) or 'parse'
+            request.manager.commands = CommandLog(request.url, callback)
+
+    def _record_commands(self, commands):
+        """Add the commands issued under a lease to the stats, and warn when
+        there are more than ``WEBDRIVER_COMMAND_BUDGET``.
+
+        With ``WEBDRIVER_COMMAND_STATS``, the WebDriver commands are counted
+        by name under ``webdriver/commands/count/<name>``, their latencies
+        summed under ``webdriver/commands/seconds/<name>``, and the number of
+        commands per lease kept as the ``webdriver/commands/per_lease``
+        histogram.
+
+        """
+        stats = self.crawler.stats
+        for command, count in commands.counts.iteritems():
+            stats.inc_value('webdriver/commands/count/%s' % command, count)
+            stats.inc_value('webdriver/commands/seconds/%s' % command,
+                            commands.seconds[command])
+        record_histogram(stats, 'webdriver/commands/per_lease',
+                         commands.total, COUNT_BOUNDS)
+        if self._command_budget and commands.total > self._command_budget:
+            log.msg('%s issued %d webdriver commands (%d downloading, %d in '
+                    '%s) taking %.2fs, over WEBDRIVER_COMMAND_BUDGET (%d)' % (
+                        commands.url, commands.total,
+                        commands.phases['download'],
+                        commands.phases['callback'], commands.callback,
+                        commands.total_seconds, self._command_budget),
+                    level=log.WARNING)
+            stats.inc_value('webdriver/commands/over_budget')
+
+    def _record_queue_depth(self):
+        stats = self.crawler.stats
+        for kind, depth in self.queue_depth().iteritems():
+            stats.set_value('webdriver/queue/%s' % kind, depth)
+            stats.max_value('webdriver/queue/%s_max' % kind, depth)
+
+    def release(self, request):
+        """Release the lease the request holds on its webdriver instance."""
+        request.holds_lease = False
+        request.manager.release()
 
     def _cleanup(self):
         """Clean up when the scrapy engine stops."""
-        if self._webdriver is not None:
-            self._webdriver.quit()
-            assert len(self._wait_queue) + len(self._wait_inpage_queue) == 0, \
-                'Webdriver queue not empty at engine stop.'
+        quitting = []
+        if self._spare is not None:
+            self._stop_proxy(self._spare)
+            self._spare.quit()
+            self._spare = None
+        for instance in self._instances:
+            if instance._webdriver is not None and instance._browser is None:
+                self._stop_proxy(instance._webdriver)
+                instance._webdriver.quit()
+            if instance._session is not None:
+                quitting.append(instance._session.quit())
+        for browser in self._browsers:
+            browser.quit()
+        waiting = sum(self.queue_depth().values())
+        assert waiting == 0, 'Webdriver queue not empty at engine stop.'
+        return defer.DeferredList(quitting, consumeErrors=True)
@@ -1,3 +1,5 @@
+from time import time
+
 from scrapy.exceptions import IgnoreRequest, NotConfigured
 from scrapy import log
 
@@ -8,6 +10,10 @@ class WebdriverSpiderMiddleware(object):
     """This middleware coordinates concurrent webdriver access attempts."""
     def __init__(self, crawler):
         self.manager = WebdriverManager(crawler)
+        self.stats = crawler.stats
+        self._static_first = crawler.settings.getbool('WEBDRIVER_STATIC_FIRST',
+                                                      False)
+        self.cache = self.manager.cache
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -25,34 +31,78 @@ class WebdriverSpiderMiddleware(object):
         in the manager, from which we pop the next in line after we release the
         webdriver instance while processing spider output.
 
+        Requests loaded back from the ``JOBDIR`` when resuming a crawl wait in
+        the manager too, they are started along with the start requests.
+
         """
-        return self._process_requests(start_requests, start=True)
+        for request in self._process_requests(start_requests, spider,
+                                              start=True):
+            yield request
+        next_request = self.manager.acquire_next()
+        while next_request is not WebdriverRequest.WAITING:
+            yield next_request.replace(dont_filter=True)
+            next_request = self.manager.acquire_next()
 
     def process_spider_output(self, response, result, spider):
         """Return spider result, with some requests reordered by the manager.
 
         See ``process_start_requests`` for a description of the reordering.
+        The time the callback spends parsing a response that holds its lease
+        is recorded as the ``callback`` timing (see
+        ``WebdriverInstance.record_timing``).
 
         """
-        for item_or_request in self._process_requests(result):
+        started = time()
+        if self._is_static_first(response.request):
+            self._record_escalation(response, spider)
+        if self.cache is not None and self._is_cacheable(response):
+            self.cache.store_response(spider, response.request, response)
+        if self._is_detached(response):
+            # Snapshot responses gave their lease back as soon as the page
+            # source was captured, so the next waiting request can start
+            # navigating while the callback is still parsing.
+            next_request = self.manager.acquire_next()
+            if next_request is not WebdriverRequest.WAITING:
+                yield next_request.replace(dont_filter=True)
+        for item_or_request in self._process_requests(result, spider):
             yield item_or_request
-        if isinstance(response.request, WebdriverRequest):
-            # We are here because the current request holds the webdriver lock.
-            # That lock was kept for the entire duration of the response
-            # parsing callback to keep the webdriver instance intact, and we
-            # now release it.
-            self.manager.release(response.request.url)
+        if self._holds_lease(response):
+            # We are here because the current request holds the lease on its
+            # webdriver instance. That lease was kept for the entire duration
+            # of the response parsing callback to keep the webdriver instance
+            # intact, and we now release it.
+            response.request.manager.record_timing('callback',
+                                                   time() - started)
+            self.manager.release(response.request)
             next_request = self.manager.acquire_next()
             if next_request is not WebdriverRequest.WAITING:
                 yield next_request.replace(dont_filter=True)
 
-    def _process_requests(self, items_or_requests, start=False):
-        """Acquire the webdriver manager when it's available for requests."""
+    def _process_requests(self, items_or_requests, spider, start=False):
+        """Acquire the webdriver manager when it's available for requests.
+
+        Requests whose page is in the cache don't need the webdriver at all.
+
+        """
         error_msg = "WebdriverRequests from start_requests can't be in-page."
         for request in iter(items_or_requests):
             if isinstance(request, WebdriverRequest):
+                # copies of a leased request only hold a lease once the
+                # manager gives them one
+                request.holds_lease = False
                 if start and isinstance(request, WebdriverActionRequest):
                     raise IgnoreRequest(error_msg)
+                if self._is_cached_request(request, spider):
+                    # The download handler replays the page from the cache.
+                    request.manager = self.manager
+                    yield request
+                    continue
+                if self._is_static_first(request):
+                    # The download handler leases an instance through the
+                    # manager only if the page turns out to need webdriver.
+                    request.manager = self.manager
+                    yield request
+                    continue
                 request = self.manager.acquire(request)
                 if request is WebdriverRequest.WAITING:
                     continue  # Request has been enqueued, so drop it.
@@ -65,11 +115,92 @@ class WebdriverSpiderMiddleware(object):
         """
         if isinstance(response.request, WebdriverRequest):
 
-            # release the lock that was acquired for this URL
-            self.manager.release(response.request.url)
+            # release the lease that was acquired for this URL, unless it was
+            # already given back when the snapshot was taken
+            if self._holds_lease(response):
+                self.manager.release(response.request)
 
             next_request = self.manager.acquire_next()
-            return [next_request]
+            if next_request is not WebdriverRequest.WAITING:
+                return [next_request.replace(dont_filter=True)]
+            return []
+
+    def _is_cached_request(self, request, spider):
+        """Return whether the request's page is in the cache, and mark it so.
+
+        The ``webdriver_cached`` meta key tells the download handler to
+        replay the page from the cache, without the request ever holding a
+        lease on a webdriver instance. Only the mark is kept in the request
+        while it is scheduled, the page is read when it is downloaded (see
+        ``WebdriverDownloadHandler._download_cached``). Replayed responses
+        are told apart by their ``'webdriver_cached'`` flag, rather than by
+        the meta that child requests may copy.
+
+        """
+        cached = (self.cache is not None and
+                  not isinstance(request, WebdriverActionRequest) and
+                  self.cache.is_cached(spider, request))
+        if cached:
+            request.meta['webdriver_cached'] = True
+        else:
+            request.meta.pop('webdriver_cached', None)
+        return cached
+
+    def _is_static_first(self, request):
+        """Return whether the request is first downloaded without webdriver.
+
+        See ``WebdriverDownloadHandler._download_static_first``.
+
+        """
+        if (not isinstance(request, WebdriverRequest) or
+                isinstance(request, WebdriverActionRequest)):
+            return False
+        return request.meta.get('webdriver_static_first', self._static_first)
+
+    def _record_escalation(self, response, spider):
+        """Keep track of how many static-first requests needed webdriver."""
+        if _is_cached(response):
+            return
+        self.stats.inc_value('webdriver/static/total', spider=spider)
+        if 'webdriver_escalated' in response.flags:
+            self.stats.inc_value('webdriver/static/escalated', spider=spider)
+        total = self.stats.get_value('webdriver/static/total', spider=spider)
+        escalated = self.stats.get_value('webdriver/static/escalated', 0,
+                                         spider=spider)
+        self.stats.set_value('webdriver/static/escalation_ratio',
+                             float(escalated) / total, spider=spider)
+
+    def _is_cacheable(self, response):
+        """Return whether the response is a page rendered by the webdriver."""
+        request = response.request
+        return (isinstance(response, WebdriverResponse) and
+                not isinstance(request, WebdriverActionRequest) and
+                not _is_cached(response))
+
+    def _is_detached(self, response):
+        """Return whether a rendered response was detached from its browser.
+
+        Detached responses gave their lease back when they were downloaded.
+
+        """
+        return (isinstance(response.request, WebdriverRequest) and
+                not _is_cached(response) and
+                getattr(response, 'detached', False))
+
+    def _holds_lease(self, response):
+        """Return whether the response's request still holds its lease.
+
+        This is whatever the response, as downloader middlewares (like the
+        stock cache) may substitute their own for a page that was leased an
+        instance.
+
+        """
+        return getattr(response.request, 'holds_lease', False)
+
+
+def _is_cached(response):
+    """Return whether the response was replayed from the webdriver cache."""
+    return 'webdriver_cached' in response.flags
 
 class WebdriverDownloaderMiddleware(object):
     """This middleware handles webdriver.get failures."""
@@ -0,0 +1,214 @@
+"""A local proxy keeping browsers from loading some of the page resources.
+
+See ``WEBDRIVER_BLOCK_RESOURCES``.
+
+"""
+import re
+from urlparse import urlsplit
+
+from twisted.internet import protocol, reactor
+from twisted.protocols.basic import LineReceiver
+
+# Resource types, told apart by the extension of their URL path, or by the
+# Accept header the browser sends for them.
+RESOURCE_TYPES = {
+    'image': ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg', '.ico',
+              '.bmp'),
+    'font': ('.woff', '.woff2', '.ttf', '.otf', '.eot'),
+    'media': ('.mp4', '.webm', '.ogg', '.ogv', '.mp3', '.wav', '.m4a', '.avi',
+              '.mov', '.flv'),
+    'stylesheet': ('.css',),
+    'script': ('.js',),
+}
+ACCEPT_TYPES = (
+    ('image/', 'image'),
+    ('text/css', 'stylesheet'),
+    ('video/', 'media'),
+    ('audio/', 'media'),
+)
+# Headers only meant for the proxy, or for a connection we don't keep alive.
+HOP_HEADERS = ('connection', 'keep-alive', 'proxy-connection',
+               'proxy-authorization')
+
+
+def resource_type(url, accept=None):
+    """Return the type of the resource at the URL, if it can be told."""
+    path = urlsplit(url).path.lower()
+    for kind, extensions in RESOURCE_TYPES.iteritems():
+        if path.endswith(extensions):
+            return kind
+    if accept:
+        for prefix, kind in ACCEPT_TYPES:
+            if accept.startswith(prefix):
+                return kind
+
+
+class BlockRules(object):
+    """Which resources to block, from a ``WEBDRIVER_BLOCK_RESOURCES`` spec.
+
+    The spec is a dict with resource ``types`` (see ``RESOURCE_TYPES``) and
+    ``urls`` regular expressions. HTTPS connections are tunnelled, so only
+    their ``host:port`` is known, which only ``urls`` can match.
+
+    """
+    def __init__(self, spec):
+        spec = spec or {}
+        unknown = set(spec.get('types', ())) - set(RESOURCE_TYPES)
+        if unknown:
+            raise ValueError('Unknown resource types to block: %s.' %
+                             ', '.join(sorted(unknown)))
+        self.types = frozenset(spec.get('types', ()))
+        self.urls = [re.compile(url) for url in spec.get('urls', ())]
+
+    def blocks(self, url, accept=None):
+        """Return why the URL is blocked, or None if it isn't."""
+        for pattern in self.urls:
+            if pattern.search(url):
+                return 'url'
+        if self.types:
+            kind = resource_type(url, accept)
+            if kind in self.types:
+                return kind
+
+
+class _Upstream(protocol.Protocol):
+    """The connection from the proxy to the server."""
+    def connectionMade(self):
+        self.factory.client.upstreamConnected(self)
+
+    def dataReceived(self, data):
+        self.factory.client.transport.write(data)
+        self.factory.proxy.record_bytes(len(data))
+
+    def connectionLost(self, reason):
+        self.factory.client.transport.loseConnection()
+
+
+class _UpstreamFactory(protocol.ClientFactory):
+    protocol = _Upstream
+
+    def __init__(self, client, proxy):
+        self.client = client
+        self.proxy = proxy
+
+    def clientConnectionFailed(self, connector, reason):
+        self.client.reply('502 Bad Gateway')
+
+
+class BlockingProxyProtocol(LineReceiver):
+    """The connection from a browser to the proxy.
+
+    Blocked requests get a 403 response. The others are passed on to the
+    server, one request per connection, and so are the HTTPS tunnels.
+
+    """
+    delimiter = '\r\n'
+
+    def connectionMade(self):
+        self.lines = []
+        self.pending = []
+        self.upstream = None
+        self.head = None
+
+    def lineReceived(self, line):
+        if line:
+            self.lines.append(line)
+            return
+        self.setRawMode()
+        self.handle()
+
+    def rawDataReceived(self, data):
+        if self.upstream is None:
+            self.pending.append(data)
+        else:
+            self.upstream.transport.write(data)
+
+    def handle(self):
+        try:
+            method, uri, version = self.lines[0].split(' ', 2)
+        except (IndexError, ValueError):
+            return self.reply('400 Bad Request')
+        headers = [line.split(':', 1) for line in self.lines[1:]
+                   if ':' in line]
+        accept = dict((name.strip().lower(), value.strip())
+                      for name, value in headers).get('accept')
+        if method == 'CONNECT':
+            host, _, port = uri.rpartition(':')
+            url = uri
+        else:
+            parts = urlsplit(uri)
+            host, port, url = parts.hostname, parts.port or 80, uri
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            lines = ['%s %s %s' % (method, path, version)]
+            lines.extend('%s:%s' % (name, value) for name, value in headers
+                         if name.strip().lower() not in HOP_HEADERS)
+            lines.append('Connection: close')
+            self.head = '\r\n'.join(lines) + '\r\n\r\n'
+        reason = self.factory.rules.blocks(url, accept)
+        if reason:
+            self.factory.record_blocked(reason)
+            return self.reply('403 Forbidden')
+        try:
+            port = int(port)
+        except ValueError:
+            return self.reply('400 Bad Request')
+        reactor.connectTCP(host, port, _UpstreamFactory(self, self.factory))
+
+    def upstreamConnected(self, upstream):
+        self.upstream = upstream
+        if self.head is None:
+            self.transport.write('HTTP/1.1 200 Connection established\r\n\r\n')
+        else:
+            upstream.transport.write(self.head)
+        for data in self.pending:
+            upstream.transport.write(data)
+        self.pending = []
+
+    def reply(self, status):
+        self.transport.write('HTTP/1.1 %s\r\nContent-Length: 0\r\n'
+                             'Connection: close\r\n\r\n' % status)
+        self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        if self.upstream is not None:
+            self.upstream.transport.loseConnection()
+
+
+class BlockingProxy(protocol.ServerFactory):
+    """A proxy for a single browser, listening on a local port.
+
+    The rules can be changed for each request the browser navigates to, see
+    ``use``. Blocked requests are counted in the ``webdriver/blocked/*``
+    stats, and the bytes of the responses let through in
+    ``webdriver/proxy/response_bytes``.
+
+    """
+    protocol = BlockingProxyProtocol
+
+    def __init__(self, spec, stats):
+        self.default_rules = self.rules = BlockRules(spec)
+        self.stats = stats
+        self.port = None
+
+    def listen(self):
+        """Start listening, return the port number."""
+        self.port = reactor.listenTCP(0, self, interface='127.0.0.1')
+        return self.port.getHost().port
+
+    def stop(self):
+        if self.port is not None:
+            self.port.stopListening()
+            self.port = None
+
+    def use(self, spec=None):
+        """Block resources following the given spec, or the default one."""
+        self.rules = self.default_rules if spec is None else BlockRules(spec)
+
+    def record_blocked(self, reason):
+        self.stats.inc_value('webdriver/blocked/count')
+        self.stats.inc_value('webdriver/blocked/%s' % reason)
+
+    def record_bytes(self, size):
+        self.stats.inc_value('webdriver/proxy/response_bytes', size)
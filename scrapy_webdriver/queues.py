@@ -0,0 +1,135 @@
+import json
+import os
+from heapq import heappop, heappush
+from itertools import count
+from os.path import exists, join
+from time import time
+
+from queuelib import PriorityQueue
+from scrapy.squeue import PickleFifoDiskQueue
+from scrapy.utils.reqser import request_from_dict, request_to_dict
+
+from .http import WebdriverRequest
+
+
+class PriorityWaitQueue(object):
+    """Requests waiting for a webdriver instance, highest priority first.
+
+    Requests of the same priority come out in the order they went in. With
+    ``aging``, waiting requests gain that many priority points per second, so
+    that low priority requests still make progress behind a steady stream of
+    high priority ones.
+
+    """
+    def __init__(self, aging=0):
+        self.aging = aging
+        self._heap = []
+        self._count = count()
+
+    def push(self, request):
+        # A request's priority after waiting until t is
+        # priority + aging * (t - enqueued), and since aging * t is the same
+        # for all the waiting requests, they can be ordered once and for all
+        # by priority - aging * enqueued.
+        key = self.aging * time() - request.priority
+        heappush(self._heap, (key, next(self._count), request))
+
+    def pop(self):
+        """Return the next request, raise IndexError if there is none."""
+        return heappop(self._heap)[-1]
+
+    def peek(self):
+        """Return the next request without popping it, raise IndexError if
+        there is none."""
+        return self._heap[0][-1]
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class DiskSpillWaitQueue(PriorityWaitQueue):
+    """A ``PriorityWaitQueue`` that spills requests to disk past a limit.
+
+    Once ``memory_limit`` requests are waiting in memory, new requests are
+    pushed to per-priority disk queues in ``path``, the same way the scrapy
+    scheduler does. They come back to memory, highest priority first, as
+    popped requests make room for them. Requests that can't be serialized
+    (e.g. with a callback that is not a spider method) stay in memory.
+
+    When closed, all the waiting requests are saved in ``path``, to be loaded
+    again by the next queue opened on the same path (see ``JOBDIR``).
+
+    """
+    def __init__(self, path, spider, memory_limit=0, aging=0):
+        super(DiskSpillWaitQueue, self).__init__(aging)
+        self.path = path
+        self.spider = spider
+        self.memory_limit = memory_limit
+        if not exists(path):
+            os.makedirs(path)
+        self._dqs = PriorityQueue(self._newdq, self._read_active())
+
+    def push(self, request):
+        if self.memory_limit and len(self._heap) >= self.memory_limit:
+            if self._dqpush(request):
+                return
+        super(DiskSpillWaitQueue, self).push(request)
+
+    def pop(self):
+        """Return the next request, raise IndexError if there is none."""
+        self._refill()
+        return super(DiskSpillWaitQueue, self).pop()
+
+    def peek(self):
+        self._refill()
+        return super(DiskSpillWaitQueue, self).peek()
+
+    def close(self):
+        """Save all the waiting requests to disk.
+
+        Return the requests that couldn't be saved.
+
+        """
+        unserializable = []
+        while self._heap:
+            request = super(DiskSpillWaitQueue, self).pop()
+            if not self._dqpush(request):
+                unserializable.append(request)
+        with open(join(self.path, 'active.json'), 'w') as f:
+            json.dump(self._dqs.close(), f)
+        self._dqs = PriorityQueue(self._newdq)
+        return unserializable
+
+    def _refill(self):
+        while not self.memory_limit or len(self._heap) < self.memory_limit:
+            request = self._dqpop()
+            if request is None:
+                break
+            super(DiskSpillWaitQueue, self).push(request)
+
+    def _dqpush(self, request):
+        try:
+            self._dqs.push(request_to_dict(request, self.spider),
+                           -request.priority)
+        except ValueError:  # non serializable request
+            return False
+        return True
+
+    def _dqpop(self):
+        d = self._dqs.pop()
+        if d:
+            return request_from_dict(d, self.spider).replace(
+                cls=WebdriverRequest)
+
+    def _newdq(self, priority):
+        return PickleFifoDiskQueue(join(self.path, 'p%s' % priority))
+
+    def _read_active(self):
+        path = join(self.path, 'active.json')
+        if not exists(path):
+            return ()
+        with open(path) as f:
+            return json.load(f)
+
+    def __len__(self):
+        return len(self._heap) + len(self._dqs)
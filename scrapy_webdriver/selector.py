@@ -1,12 +1,18 @@
 import re
+from xml.sax.saxutils import escape
 
+from lxml import etree
 from scrapy.selector import Selector, SelectorList
 
 _UNSUPPORTED_XPATH_ENDING = re.compile(r'.*/((@)?([^/()]+)(\(\))?)$')
 _UNSUPPORTED_CSS_ENDING = re.compile(r'.*(::text|::attr\(([\w-]+)\))$')
 
 
-GET_TEXT_CONTENT = """
+# Select elements from a context node (or the document), and return either
+# their text nodes or one of their attributes, all in a single round trip.
+# Attributes are read the same way as WebElement.get_attribute does: from the
+# DOM property when there is one, from the HTML attribute otherwise.
+SELECT_STRINGS = """
 var getTextContent = function(node,recurse) {
     var children = node.childNodes;
     var content = [];
@@ -21,9 +27,71 @@ var getTextContent = function(node,recurse) {
     }
     return content;
 }
-return getTextContent.apply(null, arguments)
+var getAttribute = function(element,name) {
+    var value = element[name];
+    if (typeof value == 'boolean') {
+        return value ? 'true' : null;
+    }
+    if (value == null || typeof value == 'object' ||
+            typeof value == 'function') {
+        return element.getAttribute(name);
+    }
+    return String(value);
+}
+var context = arguments[0] || document, query = arguments[1],
+    byCss = arguments[2], attribute = arguments[3], recurse = arguments[4];
+var elements = [];
+if (byCss) {
+    elements = context.querySelectorAll(query);
+} else {
+    var result = document.evaluate(query, context, null,
+        XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (var i = 0; i < result.snapshotLength; i++) {
+        elements.push(result.snapshotItem(i));
+    }
+}
+var strings = [];
+for (var i = 0; i < elements.length; i++) {
+    if (attribute) {
+        strings.push(getAttribute(elements[i], attribute));
+    } else {
+        strings.push.apply(strings, getTextContent(elements[i], recurse));
+    }
+}
+return strings;
+"""
+
+# Return the rendered text of several elements in a single round trip.
+GET_TEXTS = """
+var elements = arguments[0], texts = [];
+for (var i = 0; i < elements.length; i++) {
+    var text = elements[i].innerText;
+    if (text == null) {
+        text = elements[i].textContent;
+    }
+    texts.push(text.replace(/^\\s+|\\s+$/g, ''));
+}
+return texts;
 """
 
+
+class WebdriverSelectorList(SelectorList):
+    """A SelectorList that extracts all its elements in a single round trip."""
+    def extract(self):
+        elements = [s.element for s in self if _is_element_selector(s)]
+        if not elements:
+            return super(WebdriverSelectorList, self).extract()
+        webdriver = next(s.webdriver for s in self if _is_element_selector(s))
+        texts = iter(webdriver.execute_script(GET_TEXTS, elements))
+        return [next(texts) if _is_element_selector(s) else s.extract()
+                for s in self]
+
+
+def _is_element_selector(selector):
+    return (isinstance(selector, WebdriverXPathSelector) and
+            selector.element is not None)
+
+
 class WebdriverXPathSelector(Selector):
     """Scrapy selector that works using XPath selectors in a remote browser.
 
@@ -45,6 +113,9 @@ class WebdriverXPathSelector(Selector):
           - a.clicky::attr(href)
           - h2.heading::text
           - h2.heading ::text
+
+        Those are resolved in the browser, with a single script execution
+        returning all the strings at once.
         """
         elem = self.element if self.element else self.webdriver
         psuedo, recurse, attr = None, False, None
@@ -56,10 +127,11 @@ class WebdriverXPathSelector(Selector):
             if css.endswith(' '):
                 recurse = True
                 css = css[:-1]
+            return self._select_strings(css, True, psuedo == '::text',
+                                        recurse, attr)
 
         elems = elem.find_elements_by_css_selector(css)
-        is_text = (psuedo == '::text')
-        return self._make_selector_list(elems, is_text, recurse, attr)
+        return self._make_selector_list(elems)
 
     def xpath(self, xpath):
         """Return elements using the webdriver `find_elements_by_xpath` method.
@@ -72,6 +144,8 @@ class WebdriverXPathSelector(Selector):
 
         This function offers workarounds for both, so it should be safe to use
         them as you would with HtmlXPathSelector for simple content extraction.
+        The workarounds run in the browser, with a single script execution
+        returning all the strings at once.
 
         """
         xpathev = self.element if self.element else self.webdriver
@@ -90,14 +164,16 @@ class WebdriverXPathSelector(Selector):
                 if xpath.endswith('/'):
                     xpath = xpath[:-1]
                     recurse = True
+        if is_text or attr:
+            return self._select_strings(xpath, False, is_text, recurse, attr)
 
         elems = xpathev.find_elements_by_xpath(xpath)
-        return self._make_selector_list(elems, is_text, recurse, attr)
+        return self._make_selector_list(elems)
 
     def select_script(self, script, *args):
         """Return elements using JavaScript snippet execution."""
         result = self.webdriver.execute_script(script, *args)
-        return SelectorList(self._make_result(result))
+        return WebdriverSelectorList(self._make_result(result))
 
     def _make_result(self, result):
         if type(result) is not list:
@@ -105,25 +181,17 @@ class WebdriverXPathSelector(Selector):
         return [self.__class__(webdriver=self.webdriver, element=e)
                 for e in result]
 
-    def _make_selector_list(self, elems, is_text, text_recurse, attr):
-        if type(elems) is not list:
-            elems = [elems]
+    def _make_selector_list(self, elems):
+        return WebdriverSelectorList(self._make_result(elems))
 
+    def _select_strings(self, query, by_css, is_text, text_recurse, attr):
+        strings = self.webdriver.execute_script(
+            SELECT_STRINGS, self.element, query, by_css,
+            None if is_text else attr, text_recurse)
         if is_text:
-            return SelectorList(
-                _TextNode(self.webdriver, s)
-                for elem in elems
-                for s in self._text_content(elem, text_recurse)
-            )
-
-        selectors = self._make_result(elems)
-        if attr:
-            selectors = (_NodeAttribute(s.element, attr) for s in selectors)
-        return SelectorList(selectors)
-
-    def _text_content(self, element, recurse):
-        return self.webdriver.execute_script(GET_TEXT_CONTENT,
-                                             element, recurse)
+            return WebdriverSelectorList(_TextNode(self.webdriver, s)
+                                         for s in strings)
+        return WebdriverSelectorList(_NodeAttribute(attr, s) for s in strings)
 
     def extract(self):
         """Extract text from selenium element."""
@@ -142,14 +210,77 @@ class WebdriverXPathSelector(Selector):
         return self.element.get_attribute('innerHTML')
 
 
+class WebdriverSnapshotSelector(Selector):
+    """Scrapy selector that works on the page source captured in a response.
+
+    It offers the same API as ``WebdriverXPathSelector``, but XPath and CSS
+    queries, including text and attribute selection, are evaluated locally
+    by lxml, without any round trip to the browser. Note that, as with any
+    scrapy selector, ``extract`` returns markup and attributes are returned
+    as written in the page source.
+
+    The webdriver is only used when live element handles are asked for,
+    through ``element``, ``live`` or ``select_script``, which requires the
+    response not to be detached.
+
+    """
+    def __init__(self, response=None, webdriver=None, *args, **kwargs):
+        kwargs['response'] = response
+        super(WebdriverSnapshotSelector, self).__init__(*args, **kwargs)
+        if webdriver is None:
+            webdriver = getattr(response, 'webdriver', None)
+        self.webdriver = webdriver
+
+    def xpath(self, query):
+        result = super(WebdriverSnapshotSelector, self).xpath(query)
+        for selector in result:
+            selector.webdriver = self.webdriver
+        return result
+
+    @property
+    def element(self):
+        """Return the live WebElement matching this node of the snapshot.
+
+        Only element nodes have a matching WebElement, other nodes (text or
+        attributes) give ``None``.
+
+        """
+        if not etree.iselement(self._root):
+            return None
+        path = self._root.getroottree().getpath(self._root)
+        return self._live_webdriver.find_element_by_xpath(path)
+
+    def live(self):
+        """Return a ``WebdriverXPathSelector`` on the matching live element."""
+        return WebdriverXPathSelector(webdriver=self._live_webdriver,
+                                      element=self.element)
+
+    def select_script(self, script, *args):
+        """Return elements using JavaScript snippet execution."""
+        return self.live().select_script(script, *args)
+
+    def extract_html(self):
+        root = self._root
+        return escape(root.text or u'') + u''.join(
+            etree.tostring(child, method=self._tostring_method,
+                           encoding=unicode)
+            for child in root)
+
+    @property
+    def _live_webdriver(self):
+        if self.webdriver is None:
+            raise ValueError('Detached responses have no live elements.')
+        return self.webdriver
+
+
 class _NodeAttribute(object):
     """Works around webdriver XPath inability to select attributes."""
-    def __init__(self, element, attribute):
-        self.element = element
+    def __init__(self, attribute, value):
         self.attribute = attribute
+        self.value = value
 
     def extract(self):
-        return self.element.get_attribute(self.attribute)
+        return self.value
 
 
 class _TextNode(object):
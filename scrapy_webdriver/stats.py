@@ -0,0 +1,120 @@
+"""Histograms of the timings and sizes of the render path, in the crawler
+stats.
+
+A value is counted in the bucket of the smallest bound it doesn't exceed, as
+``<prefix>/le_<bound>`` (``le_inf`` past the largest bound), along with the
+``<prefix>/count``, ``<prefix>/total`` and ``<prefix>/max`` of the values.
+Percentiles are estimated from the buckets by ``record_percentiles``.
+
+The WebDriver commands issued for each request are accounted for in a
+``CommandLog`` (see ``WEBDRIVER_COMMAND_STATS``).
+
+"""
+from collections import defaultdict
+from threading import Lock
+from time import time
+
+TIME_BOUNDS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+               60, 120)  # seconds
+SIZE_BOUNDS = tuple(1024 * 4 ** i for i in xrange(8))  # 1KB to 16MB
+COUNT_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+PERCENTILES = (50, 90, 99)
+
+# values are recorded from the download threads too
+_lock = Lock()
+
+
+def record_histogram(stats, prefix, value, bounds):
+    """Count a value in the histogram with the given stats key prefix."""
+    for bound in bounds:
+        if value <= bound:
+            break
+    else:
+        bound = 'inf'
+    with _lock:
+        stats.inc_value('%s/count' % prefix)
+        stats.inc_value('%s/total' % prefix, value)
+        stats.max_value('%s/max' % prefix, value)
+        stats.inc_value('%s/le_%s' % (prefix, bound))
+
+
+def record_percentiles(stats, percentiles=PERCENTILES):
+    """Set the ``<prefix>/p<percentile>`` stats of every histogram.
+
+    A percentile is estimated as the bound of the bucket it falls in, or as
+    the largest value for the last bucket.
+
+    """
+    values = stats.get_stats()
+    histograms = defaultdict(list)
+    for key, count in values.items():
+        prefix, _, name = key.rpartition('/')
+        if name.startswith('le_'):
+            histograms[prefix].append((float(name[3:]), count))
+    for prefix, buckets in histograms.iteritems():
+        buckets.sort()
+        total = sum(count for _, count in buckets)
+        for percentile in percentiles:
+            rank = total * percentile / 100.
+            seen = 0
+            for bound, count in buckets:
+                seen += count
+                if seen >= rank:
+                    break
+            if bound == float('inf'):
+                bound = values['%s/max' % prefix]
+            stats.set_value('%s/p%d' % (prefix, percentile), bound)
+
+
+class CommandLog(object):
+    """The WebDriver commands issued under one lease of a webdriver instance.
+
+    Commands are counted, and their latencies summed, by command name. They
+    are also counted by phase: ``'download'`` until the response is
+    returned, and ``'callback'`` after that, while the callback parses it.
+
+    """
+    def __init__(self, url, callback=None):
+        self.url = url
+        self.callback = callback
+        self.phase = 'download'
+        self.counts = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.phases = defaultdict(int)
+
+    @property
+    def total(self):
+        return sum(self.counts.itervalues())
+
+    @property
+    def total_seconds(self):
+        return sum(self.seconds.itervalues())
+
+    def record(self, command, seconds):
+        self.counts[command] += 1
+        self.seconds[command] += seconds
+        self.phases[self.phase] += 1
+
+    def __repr__(self):
+        return '<CommandLog %s: %d commands in %.3fs>' % (
+            self.url, self.total, self.total_seconds)
+
+
+def count_commands(webdriver, instance):
+    """Log the commands of a webdriver to the ``commands`` of an instance.
+
+    The ``execute`` method of the webdriver is wrapped, so that the commands
+    of the WebElements it returns are logged too.
+
+    """
+    execute = webdriver.execute
+
+    def counting_execute(driver_command, params=None):
+        started = time()
+        try:
+            return execute(driver_command, params)
+        finally:
+            commands = instance.commands
+            if commands is not None:
+                commands.record(driver_command, time() - started)
+    webdriver.execute = counting_execute
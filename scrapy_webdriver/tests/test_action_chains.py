@@ -0,0 +1,91 @@
+import pytest
+from mock import Mock
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+
+from scrapy_webdriver.action_chains import (CompiledActionChains, RUN_STEPS,
+                                            WaitingActionChains)
+from scrapy_webdriver.wait import NAVIGATED, WAIT_UNTIL
+
+
+class TestWaitingActionChains:
+    def test_wait_in_browser(self):
+        driver = Mock(w3c=False)
+        chains = WaitingActionChains(driver)
+        chains.wait(5, name='visibility_of_element_located',
+                    args=[(By.CSS_SELECTOR, '#results')])
+        chains.perform()
+        driver.set_script_timeout.assert_called_with(6)
+        script, spec, timeout = driver.execute_async_script.call_args[0]
+        assert script == WAIT_UNTIL
+        assert 'locate("css selector", "#results")' in spec['js']
+        assert timeout == 5000
+
+        driver.execute_async_script.return_value = False
+        with pytest.raises(TimeoutException):
+            chains.perform()
+
+    def test_wait_polling(self):
+        driver = Mock(w3c=False)
+        chains = WaitingActionChains(driver)
+        # Conditions on elements can't be evaluated in the browser.
+        chains.wait(5, name='staleness_of', args=[Mock()])
+        assert not driver.execute_async_script.called
+        with pytest.raises(ValueError):
+            chains.wait(5)
+
+
+class TestCompiledActionChains:
+    def test_perform(self):
+        driver = Mock(w3c=False)
+        driver.execute_async_script.side_effect = [
+            {'index': 1, 'native': True}, {'index': 1}]
+        element = Mock()
+        chains = CompiledActionChains(driver)
+        chains.scroll_to((By.ID, 'search'))
+        chains.send_keys_to_element((By.NAME, 'q'), 'scrapy')
+        chains.move_to_element(element)
+        chains.click(element)
+        chains.perform()
+
+        # The two compiled steps ran in one script, and the one that needed
+        # to be native was performed natively.
+        first, second = driver.execute_async_script.call_args_list
+        assert first[0] == (RUN_STEPS, [
+            {'kind': 'scroll', 'locator': ['id', 'search'], 'x': 0, 'y': 0},
+            {'kind': 'type', 'locator': ['name', 'q'], 'text': u'scrapy'}])
+        driver.find_element.assert_called_once_with('name', 'q')
+        driver.find_element().send_keys.assert_called_once_with(u'scrapy')
+        assert second[0] == (RUN_STEPS, [{'kind': 'click',
+                                          'element': element}])
+
+    def test_navigating_click(self):
+        driver = Mock(w3c=False)
+        driver.execute_async_script.side_effect = [
+            {'index': 2, 'navigating': True}, {'index': 1}]
+        driver.execute_script.side_effect = [False, True]
+        chains = CompiledActionChains(driver)
+        chains.send_keys_to_element((By.NAME, 'q'), 'scrapy')
+        chains.click((By.ID, 'submit'))
+        chains.wait(5, name='presence_of_element_located',
+                    args=[(By.ID, 'results')])
+        chains.perform()
+
+        # The click ended its script, and the wait only started once the new
+        # page was loaded.
+        first, second = driver.execute_async_script.call_args_list
+        assert [step['kind'] for step in first[0][1]] == ['type', 'click']
+        assert [step['kind'] for step in second[0][1]] == ['wait']
+        driver.execute_script.assert_called_with(NAVIGATED, 'normal')
+        assert driver.execute_script.call_count == 2
+
+    def test_wait_timeout(self):
+        driver = Mock(w3c=False)
+        driver.execute_async_script.return_value = {'index': 0,
+                                                    'timeout': True}
+        chains = CompiledActionChains(driver)
+        chains.wait(5, name='title_contains', args=['Results'])
+        chains.click((By.ID, 'next'))
+        with pytest.raises(TimeoutException):
+            chains.perform()
+        driver.set_script_timeout.assert_called_with(6)
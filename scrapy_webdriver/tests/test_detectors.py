@@ -0,0 +1,43 @@
+from scrapy.http import HtmlResponse, Response
+from scrapy.settings import Settings
+
+from scrapy_webdriver.detectors import (BodySizeDetector,
+                                        ExpectedSelectorDetector,
+                                        NoscriptDetector)
+from scrapy_webdriver.http import WebdriverRequest
+
+PAGE = ('<html><body><div id="content">%s</div>'
+        '<noscript><img src="/pixel.gif"></noscript></body></html>')
+
+
+def response(body):
+    return HtmlResponse('http://testdomain/', body=body)
+
+
+class TestDetectors:
+    def test_expected_selector(self):
+        detector = ExpectedSelectorDetector(Settings())
+        request = WebdriverRequest('http://testdomain/',
+                                   meta={'webdriver_expect_css': '#content p'})
+        assert detector.needs_webdriver(request, response(PAGE % ''))
+        assert not detector.needs_webdriver(request,
+                                            response(PAGE % '<p>text</p>'))
+        request = WebdriverRequest('http://testdomain/')
+        assert not detector.needs_webdriver(request, response(PAGE % ''))
+
+    def test_noscript(self):
+        detector = NoscriptDetector(Settings())
+        request = WebdriverRequest('http://testdomain/')
+        assert not detector.needs_webdriver(request, response(PAGE % ''))
+        wall = '<noscript>Please enable JavaScript.</noscript>'
+        assert detector.needs_webdriver(request, response(PAGE % wall))
+
+    def test_body_size(self):
+        detector = BodySizeDetector(Settings(values={
+            'WEBDRIVER_STATIC_MIN_BODY_SIZE': 200}))
+        request = WebdriverRequest('http://testdomain/')
+        assert detector.needs_webdriver(request, response(PAGE % ''))
+        assert not detector.needs_webdriver(request,
+                                            response(PAGE % ('x' * 200)))
+        binary = Response('http://testdomain/', body='')
+        assert not detector.needs_webdriver(request, binary)
@@ -0,0 +1,151 @@
+import pytest
+from mock import Mock, patch
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from selenium.common.exceptions import TimeoutException
+from twisted.internet import defer
+
+from scrapy_webdriver.download import WebdriverDownloadHandler
+from scrapy_webdriver.http import WebdriverRequest, WebdriverResponse
+from scrapy_webdriver.wait import NAVIGATE, NAVIGATED, WAIT_UNTIL
+
+
+class TestDownloadHandler:
+    def handler(self, **options):
+        options.setdefault('WEBDRIVER_BROWSER', 'PhantomJS')
+        return WebdriverDownloadHandler(Settings(values=options))
+
+    def request(self, **kwargs):
+        request = WebdriverRequest('http://testdomain/path', **kwargs)
+        request.manager = Mock()
+        request.manager.webdriver.page_source = u'<html>page</html>'
+        return request
+
+    def test_live_response(self):
+        request = self.request()
+        response = self.handler()._response(request, request.url)
+        assert not response.detached
+        assert response.webdriver is request.manager.webdriver
+        assert not request.manager.manager.release.called
+
+    def test_snapshot_response(self):
+        request = self.request(meta={'webdriver_snapshot': True})
+        response = self.handler()._response(request, request.url)
+        assert response.detached
+        assert response.body == '<html>page</html>'
+        assert request.manager.manager.release.called
+
+        request = self.request()
+        handler = self.handler(WEBDRIVER_SNAPSHOT=True)
+        assert handler._response(request, request.url).detached
+        request = self.request(meta={'webdriver_snapshot': False})
+        assert not handler._response(request, request.url).detached
+
+    def test_wait_until(self):
+        spec = {'css': '#results', 'dom_quiet': 200, 'timeout': 5}
+        request = self.request(wait_until=spec)
+        self.handler()._wait_until(request, Mock())
+        request.manager.extend_script_timeout.assert_called_with(6)
+        request.manager.webdriver.execute_async_script.assert_called_with(
+            WAIT_UNTIL, spec, 5000)
+
+        request = self.request()
+        self.handler()._wait_until(request, Mock())
+        assert not request.manager.webdriver.execute_async_script.called
+
+        with pytest.raises(ValueError):
+            self.request(wait_until={'selector': '#results'})
+
+    def test_timeouts(self):
+        handler = self.handler(WEBDRIVER_PAGE_LOAD_TIMEOUT=60)
+        webdriver = Mock()
+        request = self.request(meta={'webdriver_script_timeout': 5})
+        assert handler._timeouts(request, webdriver) == [('page load', 60),
+                                                         ('script', 5)]
+        assert handler._timeouts(request, webdriver) == []
+        # Requests without timeouts of their own get the defaults back.
+        assert handler._timeouts(self.request(), webdriver) == [('script', 30)]
+
+    def test_page_load_strategy(self):
+        handler = self.handler()
+        request = self.request()
+        handler._navigate(request)
+        request.manager.webdriver.get.assert_called_with(request.url)
+
+        request = self.request(meta={'webdriver_page_load_strategy': 'eager'})
+        webdriver = request.manager.webdriver
+        webdriver.execute_script.return_value = True
+        handler._navigate(request)
+        assert not webdriver.get.called
+        webdriver.execute_script.assert_any_call(NAVIGATE, request.url)
+        webdriver.execute_script.assert_called_with(NAVIGATED, 'eager')
+
+        # The current page is never left for one of its fragments.
+        request = WebdriverRequest('http://testdomain/path#section',
+                                   meta={'webdriver_page_load_strategy':
+                                         'eager'})
+        request.manager = Mock()
+        webdriver = request.manager.webdriver
+        webdriver.current_url = 'http://testdomain/path'
+        handler._navigate(request)
+        webdriver.get.assert_called_with(request.url)
+        assert not webdriver.execute_script.called
+
+    def test_block_resources(self):
+        handler = self.handler()
+        spec = {'types': ['image']}
+        request = self.request(meta={'webdriver_block_resources': spec})
+        request.manager._browser = None
+        proxy = request.manager.webdriver._blocking_proxy = Mock()
+        handler._block_resources(request)
+        proxy.use.assert_called_once_with(spec)
+
+        # Tabs share the proxy of their browser, and keep its default spec.
+        request = self.request(meta={'webdriver_block_resources': spec})
+        proxy = request.manager.webdriver._blocking_proxy = Mock()
+        handler._block_resources(request)
+        assert not proxy.use.called
+
+    def test_unknown_page_load_strategy(self):
+        with pytest.raises(ValueError):
+            self.handler(WEBDRIVER_PAGE_LOAD_STRATEGY='fast')
+
+        # The request fails, without restarting the browser.
+        request = self.request(meta={'webdriver_page_load_strategy': 'fast'})
+        responses = []
+        with patch('scrapy.utils.decorator.threads.deferToThread',
+                   defer.maybeDeferred):
+            dfd = self.handler()._download_request(request, Mock())
+        dfd.addCallback(responses.append)
+        response, = responses
+        assert isinstance(response.exception, ValueError)
+        assert not request.manager.reconnect.called
+        assert not request.manager.webdriver.get.called
+
+    def test_failed_actions(self):
+        request = self.request()
+        request.actions = Mock()
+        request.actions.perform.side_effect = TimeoutException()
+        responses = []
+        with patch('scrapy.utils.decorator.threads.deferToThread',
+                   defer.maybeDeferred):
+            dfd = self.handler()._do_action_request(request, Mock())
+        dfd.addCallback(responses.append)
+        response, = responses
+        assert isinstance(response.exception, TimeoutException)
+        assert not request.manager.reconnect.called
+
+    def test_escalation(self):
+        handler = self.handler(WEBDRIVER_STATIC_MIN_BODY_SIZE=200)
+        request = self.request()
+        request.manager.acquire_deferred.return_value = defer.succeed(request)
+        rendered = WebdriverResponse(request.url, request.manager.webdriver)
+        handler._download_webdriver = Mock(return_value=rendered)
+        static = HtmlResponse(request.url, body='<html></html>')
+        responses = []
+        handler._escalate(static, request, Mock()).addCallback(
+            responses.append)
+        assert responses == [rendered]
+        assert 'webdriver_escalated' in rendered.flags
+        # Requests built from the response don't count as escalated.
+        assert 'webdriver_escalated' not in request.meta
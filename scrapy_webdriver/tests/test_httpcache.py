@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+
+from mock import Mock
+from scrapy.crawler import Crawler
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.spider import Spider
+
+from scrapy_webdriver.download import WebdriverDownloadHandler
+from scrapy_webdriver.http import WebdriverRequest, WebdriverResponse
+from scrapy_webdriver.middlewares import WebdriverSpiderMiddleware
+
+
+class TestHttpCache:
+    def setup_method(self, method):
+        self.cachedir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.cachedir)
+
+    def middleware(self):
+        settings = dict(WEBDRIVER_BROWSER=Mock(),
+                        WEBDRIVER_HTTPCACHE_ENABLED=True,
+                        HTTPCACHE_DIR=self.cachedir)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        return WebdriverSpiderMiddleware.from_crawler(crawler)
+
+    def download(self, request, spider):
+        handler = WebdriverDownloadHandler(Settings(values={
+            'WEBDRIVER_BROWSER': 'PhantomJS'}))
+        responses = []
+        handler.download_request(request, spider).addCallback(
+            responses.append)
+        response, = responses
+        return response
+
+    def test_replay(self):
+        spider = Spider(name='test')
+        middleware = self.middleware()
+        middleware.cache.spider_opened(spider)
+
+        request = WebdriverRequest('http://testdomain/path')
+        assert list(middleware.process_start_requests([request], spider)) \
+            == [request]
+        assert 'webdriver_cached' not in request.meta
+        webdriver = Mock(page_source=u'<html>rendered</html>')
+        response = WebdriverResponse(request.url, webdriver, request=request)
+        list(middleware.process_spider_output(response, [], spider))
+
+        # The second time around, the page is replayed from the cache, and
+        # the webdriver instance is left alone.
+        request = WebdriverRequest('http://testdomain/path')
+        next_request = WebdriverRequest('http://testdomain/other')
+        output = list(middleware.process_start_requests([request,
+                                                         next_request],
+                                                        spider))
+        assert output == [request, next_request]
+        # Only the mark is kept in the scheduled request, the page is read
+        # from the cache by the download handler.
+        assert request.meta['webdriver_cached'] is True
+        cached = self.download(request, spider)
+        assert cached.detached
+        assert 'webdriver_cached' in cached.flags
+        assert cached.body == '<html>rendered</html>'
+        assert next_request.manager is not None
+
+    def test_child_of_cached_response(self):
+        spider = Spider(name='test')
+        middleware = self.middleware()
+        middleware.cache.spider_opened(spider)
+        request = WebdriverRequest('http://testdomain/path')
+        list(middleware.process_start_requests([request], spider))
+        webdriver = Mock(page_source=u'<html>rendered</html>')
+        response = WebdriverResponse(request.url, webdriver, request=request)
+        list(middleware.process_spider_output(response, [], spider))
+        request = WebdriverRequest('http://testdomain/path')
+        list(middleware.process_start_requests([request], spider))
+        cached = self.download(request, spider)
+        cached.request = request
+
+        # A child request copying the meta of the cached response, but
+        # missing the cache, is rendered and gives its lease back.
+        child = WebdriverRequest('http://testdomain/child', meta=cached.meta)
+        assert list(middleware.process_spider_output(cached, [child],
+                                                     spider)) == [child]
+        assert child.manager.leased
+        response = WebdriverResponse(child.url, webdriver, request=child)
+        list(middleware.process_spider_output(response, [], spider))
+        assert not child.manager.leased
+
+    def test_stock_cache(self):
+        spider = Spider(name='test')
+        middleware = self.middleware()
+        middleware.cache.spider_opened(spider)
+        request = WebdriverRequest('http://testdomain/path')
+        waiting = WebdriverRequest('http://testdomain/waiting')
+        assert list(middleware.process_start_requests([request, waiting],
+                                                      spider)) == [request]
+
+        # Responses replayed by the stock cache give the lease back too.
+        response = HtmlResponse(request.url, body='<html></html>',
+                                flags=['cached'], request=request)
+        output = list(middleware.process_spider_output(response, [], spider))
+        assert [r.url for r in output] == [waiting.url]
+        assert output[0].holds_lease
+        assert not request.holds_lease
+
+    def test_expired_meanwhile(self):
+        spider = Spider(name='test')
+        middleware = self.middleware()
+        middleware.cache.spider_opened(spider)
+        request = WebdriverRequest('http://testdomain/path')
+        list(middleware.process_start_requests([request], spider))
+        webdriver = Mock(page_source=u'<html>rendered</html>')
+        response = WebdriverResponse(request.url, webdriver, request=request)
+        list(middleware.process_spider_output(response, [], spider))
+        request = WebdriverRequest('http://testdomain/path')
+        list(middleware.process_start_requests([request], spider))
+
+        # A page gone from the cache by the time it is downloaded is
+        # rendered after all, once an instance is leased.
+        shutil.rmtree(self.cachedir)
+        os.mkdir(self.cachedir)
+        handler = WebdriverDownloadHandler(Settings(values={
+            'WEBDRIVER_BROWSER': 'PhantomJS'}))
+        handler._download_webdriver = Mock()
+        handler.download_request(request, spider)
+        handler._download_webdriver.assert_called_once_with(request, spider)
+        assert request.holds_lease
@@ -1,8 +1,18 @@
+import os
+import subprocess
+
+import pytest
+from mock import Mock, patch
 from scrapy.crawler import Crawler
 from scrapy.settings import Settings
 from selenium import webdriver
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.switch_to import SwitchTo
+from twisted.internet import defer
 
-from scrapy_webdriver.manager import WebdriverManager
+from scrapy_webdriver.http import WebdriverActionRequest, WebdriverRequest
+from scrapy_webdriver.manager import WebdriverManager, _process_tree_rss
+from scrapy_webdriver.wait import NAVIGATED
 
 BASE_SETTINGS = dict(
     DOWNLOAD_HANDLERS={
@@ -14,6 +24,47 @@ BASE_SETTINGS = dict(
     })
 
 
+class FakeBrowser(object):
+    """A webdriver keeping track of the window each command runs in."""
+    w3c = False
+
+    def __init__(self):
+        self.windows = ['w0']
+        self.commands = []
+        self.state = {'current': 'w0', 'opened': 0}
+        self._switch_to = SwitchTo(self)
+
+    def execute(self, command, params=None):
+        if command == Command.SWITCH_TO_WINDOW:
+            self.state['current'] = params['name']
+            return
+        self.commands.append((self.state['current'], command))
+        if command == Command.CLOSE:
+            self.windows.remove(self.state['current'])
+
+    @property
+    def switch_to(self):
+        return self._switch_to
+
+    @property
+    def window_handles(self):
+        return list(self.windows)
+
+    @property
+    def current_window_handle(self):
+        return self.state['current']
+
+    def execute_script(self, script):
+        self.state['opened'] += 1
+        self.windows.append('w%d' % self.state['opened'])
+
+    def get(self, url):
+        self.execute(Command.GET, {'url': url})
+
+    def close(self):
+        self.execute(Command.CLOSE)
+
+
 class TestManager:
     @classmethod
     def setup_class(cls):
@@ -44,4 +95,348 @@ class TestManager:
         crawler = Crawler(Settings(values=settings))
         crawler.configure()
         browser = WebdriverManager(crawler)
-        assert isinstance(browser._webdriver, TestBrowser)
+        assert isinstance(browser._instances[0]._webdriver, TestBrowser)
+
+    def test_pool(self):
+        class TestBrowser(object):
+            pass
+
+        settings = self.settings(WEBDRIVER_BROWSER=TestBrowser,
+                                 WEBDRIVER_POOL_SIZE=2)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        requests = [WebdriverRequest('http://testdomain/path?wr=%d' % i)
+                    for i in xrange(3)]
+        first, second = [manager.acquire(r) for r in requests[:2]]
+        assert first.manager is not second.manager
+        assert manager.acquire(requests[2]) is WebdriverRequest.WAITING
+        assert manager.acquire_next() is WebdriverRequest.WAITING
+
+        manager.release(second)
+        third = manager.acquire_next()
+        assert third is requests[2]
+        assert third.manager is second.manager
+        assert manager.acquire_next() is WebdriverRequest.WAITING
+
+    def test_timing_stats(self):
+        class TestBrowser(object):
+            pass
+
+        settings = self.settings(WEBDRIVER_BROWSER=TestBrowser)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        first = manager.acquire(WebdriverRequest('http://testdomain/first'))
+        waiting = WebdriverRequest('http://testdomain/second')
+        manager.acquire(waiting)
+        assert 'webdriver_waiting_since' in waiting.meta
+        manager.release(first)
+        second = manager.acquire_next()
+        assert 'webdriver_waiting_since' not in second.meta
+
+        stats = crawler.stats
+        assert stats.get_value('webdriver/timing/acquire/count') == 2
+        assert stats.get_value('webdriver/timing/queued/count') == 1
+        assert stats.get_value('webdriver/timing/lease/count') == 1
+
+    def test_pool_inpage(self):
+        class TestBrowser(object):
+            pass
+
+        settings = self.settings(WEBDRIVER_BROWSER=TestBrowser,
+                                 WEBDRIVER_POOL_SIZE=2)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        parent = manager.acquire(WebdriverRequest('http://testdomain/'))
+        response = Mock(request=parent, actions=Mock())
+        action = WebdriverActionRequest(response)
+        # The other instance is free, but in-page requests must wait for the
+        # instance their page was loaded in.
+        assert manager.acquire(action) is WebdriverRequest.WAITING
+        manager.release(parent)
+        assert manager.acquire_next() is action
+        assert action.manager is parent.manager
+
+    def test_acquire_deferred(self):
+        class TestBrowser(object):
+            pass
+
+        settings = self.settings(WEBDRIVER_BROWSER=TestBrowser)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        first = manager.acquire(WebdriverRequest('http://testdomain/first'))
+        waiting = WebdriverRequest('http://testdomain/waiting')
+        manager.acquire(waiting)
+        escalated = WebdriverRequest('http://testdomain/escalated')
+        leased = []
+        manager.acquire_deferred(escalated).addCallback(leased.append)
+        assert not leased
+
+        # The escalated request gets the instance before the waiting one.
+        manager.release(first)
+        assert manager.acquire_next() is WebdriverRequest.WAITING
+        assert leased == [escalated]
+        assert escalated.manager is first.manager
+        manager.release(escalated)
+        assert manager.acquire_next() is waiting
+
+    def test_hot_spare(self):
+        class TestBrowser(object):
+            pass
+
+        settings = self.settings(WEBDRIVER_BROWSER=TestBrowser)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        spare = Mock()
+        manager._spare = spare
+        instance = manager._instances[0]
+        assert instance.reconnect() is spare
+        assert manager._spare is None
+
+    def test_recycle(self):
+        settings = self.settings(WEBDRIVER_BROWSER='PhantomJS',
+                                 WEBDRIVER_RECYCLE_PAGES=2)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        manager._connect = Mock(side_effect=lambda: Mock())
+        instance = manager._instances[0]
+        first = instance.webdriver
+        for i in xrange(2):
+            request = manager.acquire(WebdriverRequest('http://testdomain/'))
+            assert instance.webdriver is first
+            manager.release(request)
+
+        # The instance is only restarted at the beginning of the next lease.
+        assert not first.quit.called
+        request = manager.acquire(WebdriverRequest('http://testdomain/'))
+        assert instance.webdriver is not first
+        assert first.quit.called
+        assert crawler.stats.get_value('webdriver/recycled/pages') == 1
+
+    def test_domain_affinity(self):
+        class TestBrowser(object):
+            pass
+
+        settings = self.settings(WEBDRIVER_BROWSER=TestBrowser,
+                                 WEBDRIVER_POOL_SIZE=2,
+                                 WEBDRIVER_AFFINITY_IMBALANCE=1)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        first = manager.acquire(WebdriverRequest('http://first/'))
+        second = manager.acquire(WebdriverRequest('http://second/'))
+        manager.release(first)
+        manager.release(second)
+        instance = second.manager
+        request = manager.acquire(WebdriverRequest('http://second/page'))
+        assert request.manager is instance
+        manager.release(request)
+
+        # Past the imbalance, requests spill over to the least busy instance.
+        request = manager.acquire(WebdriverRequest('http://second/page'))
+        assert request.manager is not instance
+        assert crawler.stats.get_value('webdriver/affinity/hit') == 1
+
+    def test_tabs(self):
+        settings = self.settings(WEBDRIVER_BROWSER='PhantomJS',
+                                 WEBDRIVER_POOL_SIZE=3, WEBDRIVER_TABS=2)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        browsers = [FakeBrowser(), FakeBrowser()]
+        manager._connect = Mock(side_effect=browsers)
+        first, second, third = [instance.webdriver
+                                for instance in manager._instances]
+        assert manager._connect.call_count == 2
+        assert browsers[0].windows == ['w0', 'w1']
+        first.get('http://testdomain/first')
+        second.get('http://testdomain/second')
+        first.get('http://testdomain/first')
+        assert browsers[0].commands == [('w0', Command.GET),
+                                        ('w1', Command.GET),
+                                        ('w0', Command.GET)]
+        third.get('http://testdomain/third')
+        assert browsers[1].commands == [('w0', Command.GET)]
+
+        # Reconnecting an instance only replaces its tab.
+        second = manager._instances[1].reconnect()
+        assert browsers[0].windows == ['w0', 'w2']
+        assert second.window_handle == 'w2'
+
+        # Recycling can't restart a browser shared by tabs.
+        settings.update(WEBDRIVER_RECYCLE_MEMORY_MB=1024)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        with pytest.raises(ValueError):
+            WebdriverManager(crawler)
+
+        # Nor would a hot spare be of any use.
+        del settings['WEBDRIVER_RECYCLE_MEMORY_MB']
+        settings.update(WEBDRIVER_HOT_SPARE=True)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        manager._launch_spare = Mock()
+        manager._engine_started()
+        assert not manager._launch_spare.called
+
+    def test_command_stats(self):
+        settings = self.settings(WEBDRIVER_BROWSER='PhantomJS',
+                                 WEBDRIVER_COMMAND_BUDGET=2)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        browser = FakeBrowser()
+        manager._connect = Mock(return_value=browser)
+        request = manager.acquire(WebdriverRequest('http://testdomain/'))
+        commands = request.manager.commands
+        webdriver = request.manager.webdriver
+        webdriver.get('http://testdomain/')
+        commands.phase = 'callback'
+        webdriver.get('http://testdomain/')
+        webdriver.close()
+        assert commands.counts == {Command.GET: 2, Command.CLOSE: 1}
+        assert commands.phases == {'download': 1, 'callback': 2}
+        manager.release(request)
+        assert request.manager.commands is None
+
+        stats = crawler.stats
+        assert stats.get_value('webdriver/commands/count/get') == 2
+        assert stats.get_value('webdriver/commands/per_lease/count') == 1
+        assert stats.get_value('webdriver/commands/over_budget') == 1
+
+    def test_prefetch(self):
+        settings = self.settings(WEBDRIVER_BROWSER='PhantomJS',
+                                 WEBDRIVER_POOL_SIZE=2,
+                                 WEBDRIVER_PREFETCH=True)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        for instance in manager._instances:
+            instance._webdriver = Mock(current_window_handle='main',
+                                       window_handles=['main', 'background'])
+            instance._prefetch_handle = 'background'
+        first = manager.acquire(WebdriverRequest('http://testdomain/first'))
+        second = manager.acquire(WebdriverRequest('http://testdomain/second'))
+        waiting = WebdriverRequest('http://testdomain/waiting')
+        manager.acquire(waiting)
+        first.manager.prefetch_next(first)
+        assert waiting.manager is first.manager
+        assert manager.queue_depth()['new'] == 1
+
+        # The instance is kept for the prefetched request.
+        manager.release(first)
+        other = WebdriverRequest('http://testdomain/other')
+        assert manager.acquire(other) is WebdriverRequest.WAITING
+        assert manager.acquire_next() is waiting
+        instance = waiting.manager
+        assert instance.switch_to_prefetched(waiting.url, 'eager')
+        instance._webdriver.switch_to.window.assert_called_with('background')
+        instance._webdriver.execute_script.assert_called_with(NAVIGATED,
+                                                              'eager')
+        assert instance._prefetch_handle == 'main'
+        assert not instance.switch_to_prefetched(waiting.url)
+
+    def test_prefetch_block_resources(self):
+        settings = self.settings(WEBDRIVER_BROWSER='PhantomJS',
+                                 WEBDRIVER_PREFETCH=True,
+                                 WEBDRIVER_BLOCK_RESOURCES={'types': ['image']})
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        instance = manager._instances[0]
+        instance._webdriver = Mock(current_window_handle='main',
+                                   window_handles=['main', 'background'])
+        instance._prefetch_handle = 'background'
+        first = manager.acquire(WebdriverRequest('http://testdomain/first'))
+        spec = {'types': ['script']}
+        waiting = WebdriverRequest('http://testdomain/waiting',
+                                   meta={'webdriver_block_resources': spec})
+        manager.acquire(waiting)
+
+        # The proxy follows the rules of the current page, the next one
+        # loads once they are its own.
+        instance.prefetch_next(first)
+        assert instance._prefetched is None
+        first.meta['webdriver_block_resources'] = spec
+        instance.prefetch_next(first)
+        assert instance._prefetched is waiting
+
+    def test_prefetch_all_instances(self):
+        settings = self.settings(WEBDRIVER_BROWSER='PhantomJS',
+                                 WEBDRIVER_POOL_SIZE=2,
+                                 WEBDRIVER_PREFETCH=True)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        for instance in manager._instances:
+            instance._webdriver = Mock(current_window_handle='main',
+                                       window_handles=['main', 'background'])
+            instance._prefetch_handle = 'background'
+        leased = [manager.acquire(WebdriverRequest('http://testdomain/%d' % i))
+                  for i in xrange(2)]
+        for i in xrange(2):
+            manager.acquire(WebdriverRequest('http://testdomain/w%d' % i))
+        for request in leased:
+            request.manager.prefetch_next(request)
+        assert all(instance._prefetched is not None
+                   for instance in manager._instances)
+        # With every instance kept for a prefetched request, new requests
+        # wait.
+        manager.release(leased[0])
+        request = WebdriverRequest('http://testdomain/new')
+        assert manager.acquire(request) is WebdriverRequest.WAITING
+
+    def test_prefetch_failure(self):
+        settings = self.settings(WEBDRIVER_BROWSER='PhantomJS',
+                                 WEBDRIVER_PREFETCH=True)
+        crawler = Crawler(Settings(values=settings))
+        crawler.configure()
+        manager = WebdriverManager(crawler)
+        instance = manager._instances[0]
+        instance._webdriver = Mock()
+        instance._webdriver.switch_to.window.side_effect = Exception
+        first = manager.acquire(WebdriverRequest('http://testdomain/first'))
+        waiting = WebdriverRequest('http://testdomain/waiting')
+        manager.acquire(waiting)
+        instance.prefetch_next(first)
+        assert instance._prefetched is None
+        manager.release(first)
+        assert manager.acquire_next() is waiting
+
+    def test_process_tree_rss(self):
+        child = subprocess.Popen(['sleep', '10'])
+        try:
+            assert _process_tree_rss(child.pid) > 0
+            # count the processes of the trees
+            page_size = os.sysconf('SC_PAGE_SIZE')
+            with patch('scrapy_webdriver.manager._rss_pages', return_value=1):
+                assert _process_tree_rss(child.pid) == page_size
+                walked = _process_tree_rss(os.getpid())
+                assert walked >= 2 * page_size
+                # The tree is the same when found by scanning all the
+                # processes.
+                with patch('os.path.exists', return_value=False):
+                    assert _process_tree_rss(os.getpid()) == walked
+        finally:
+            child.kill()
+            child.wait()
+
+    def test_remote_browser_name(self):
+        for browser in ('Chrome', webdriver.Chrome):
+            settings = self.settings(WEBDRIVER_BROWSER=browser,
+                                     WEBDRIVER_BACKEND='twisted',
+                                     REMOTE_WEBDRIVER='http://hub/')
+            crawler = Crawler(Settings(values=settings))
+            crawler.configure()
+            manager = WebdriverManager(crawler)
+            manager._client = Mock()
+            manager._client.new_session.return_value = defer.succeed(Mock())
+            manager._connect_session()
+            manager._client.new_session.assert_called_once_with(
+                {'browserName': 'chrome'})
@@ -0,0 +1,69 @@
+import pytest
+from mock import Mock, patch
+from twisted.test.proto_helpers import StringTransport
+
+from scrapy_webdriver.proxy import BlockingProxy, BlockRules, resource_type
+
+
+def test_resource_type():
+    assert resource_type('http://testdomain/logo.PNG?v=2') == 'image'
+    assert resource_type('http://testdomain/font.woff2') == 'font'
+    assert resource_type('http://testdomain/pixel', 'image/webp,*/*') == \
+        'image'
+    assert resource_type('http://testdomain/page', 'text/html') is None
+
+
+class TestBlockRules:
+    def test_blocks(self):
+        rules = BlockRules({'types': ['image', 'font'],
+                            'urls': [r'google-analytics\.com']})
+        assert rules.blocks('http://testdomain/a.jpg') == 'image'
+        assert rules.blocks('http://www.google-analytics.com/ga.js') == 'url'
+        assert rules.blocks('www.google-analytics.com:443') == 'url'
+        assert rules.blocks('http://testdomain/app.js') is None
+        assert BlockRules(None).blocks('http://testdomain/a.jpg') is None
+
+    def test_unknown_type(self):
+        with pytest.raises(ValueError):
+            BlockRules({'types': ['images']})
+
+
+class TestBlockingProxy:
+    def connect(self, spec):
+        proxy = BlockingProxy(spec, Mock())
+        protocol = proxy.buildProtocol(None)
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        return proxy, protocol, transport
+
+    def test_blocked(self):
+        proxy, protocol, transport = self.connect({'types': ['image']})
+        protocol.dataReceived('GET http://testdomain/a.png HTTP/1.1\r\n'
+                              'Host: testdomain\r\n\r\n')
+        assert transport.value().startswith('HTTP/1.1 403 Forbidden')
+        assert transport.disconnecting
+        proxy.stats.inc_value.assert_any_call('webdriver/blocked/image')
+
+    @patch('scrapy_webdriver.proxy.reactor')
+    def test_forwarded(self, reactor):
+        proxy, protocol, transport = self.connect({'types': ['image']})
+        proxy.use({})
+        protocol.dataReceived('GET http://testdomain:8080/a.png?x=1 HTTP/1.1'
+                              '\r\nHost: testdomain\r\n'
+                              'Proxy-Connection: keep-alive\r\n\r\n')
+        host, port, factory = reactor.connectTCP.call_args[0]
+        assert (host, port) == ('testdomain', 8080)
+
+        upstream = factory.buildProtocol(None)
+        upstream_transport = StringTransport()
+        upstream.makeConnection(upstream_transport)
+        assert upstream_transport.value() == (
+            'GET /a.png?x=1 HTTP/1.1\r\nHost: testdomain\r\n'
+            'Connection: close\r\n\r\n')
+        upstream.dataReceived('HTTP/1.1 200 OK\r\n\r\n')
+        assert transport.value() == 'HTTP/1.1 200 OK\r\n\r\n'
+        proxy.stats.inc_value.assert_called_with(
+            'webdriver/proxy/response_bytes', 19)
+        # Back to the default rules.
+        proxy.use()
+        assert proxy.rules.blocks('http://testdomain/a.png') == 'image'
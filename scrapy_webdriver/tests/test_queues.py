@@ -0,0 +1,85 @@
+import shutil
+import tempfile
+
+from mock import patch
+from scrapy.spider import BaseSpider
+
+from scrapy_webdriver.http import WebdriverRequest
+from scrapy_webdriver.queues import DiskSpillWaitQueue, PriorityWaitQueue
+
+
+def request(name, priority=0, **kwargs):
+    return WebdriverRequest('http://testdomain/%s' % name, priority=priority,
+                            **kwargs)
+
+
+class TestPriorityWaitQueue:
+    def test_priority(self):
+        queue = PriorityWaitQueue()
+        requests = [request('a'), request('b', 10), request('c'),
+                    request('d', 10), request('e', -10)]
+        for r in requests:
+            queue.push(r)
+        assert len(queue) == 5
+        assert queue.peek().url[-1] == 'b'
+        assert [queue.pop().url[-1] for _ in xrange(5)] == list('bdace')
+        assert not queue
+
+    def test_aging(self):
+        queue = PriorityWaitQueue(aging=1)
+        with patch('scrapy_webdriver.queues.time', return_value=1000):
+            queue.push(request('old'))
+        with patch('scrapy_webdriver.queues.time', return_value=1020):
+            queue.push(request('recent', 10))
+            queue.push(request('urgent', 30))
+        # After waiting 20 seconds, the old request is worth priority 20.
+        assert [queue.pop().url for _ in xrange(3)] == [
+            'http://testdomain/urgent', 'http://testdomain/old',
+            'http://testdomain/recent']
+
+
+class TestSpider(BaseSpider):
+    name = 'test'
+
+    def parse(self, response):
+        pass
+
+
+class TestDiskSpillWaitQueue:
+    def setup_method(self, method):
+        self.path = tempfile.mkdtemp()
+        self.spider = TestSpider()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.path)
+
+    def test_spill(self):
+        queue = DiskSpillWaitQueue(self.path, self.spider, memory_limit=2)
+        for r in [request('a'), request('b', 10), request('c'),
+                  request('d', 20)]:
+            r.meta['name'] = r.url[-1]
+            queue.push(r)
+        assert len(queue._heap) == 2
+        assert len(queue) == 4
+        # Spilled requests only come back to memory as popped requests make
+        # room for them, so d gets served after b, despite its priority.
+        popped = [queue.pop() for _ in xrange(4)]
+        assert [r.meta['name'] for r in popped] == list('bdac')
+        assert all(isinstance(r, WebdriverRequest) for r in popped)
+        assert not queue
+
+    def test_resume(self):
+        queue = DiskSpillWaitQueue(self.path, self.spider, memory_limit=1)
+        queue.push(request('a'))
+        queue.push(request('b', 10, callback=self.spider.parse))
+        unserializable = request('c', callback=lambda response: None)
+        queue.push(unserializable)
+        assert queue.close() == [unserializable]
+        assert not queue
+
+        queue = DiskSpillWaitQueue(self.path, self.spider)
+        assert len(queue) == 2
+        resumed = queue.pop()
+        assert resumed.url == 'http://testdomain/b'
+        assert resumed.callback == self.spider.parse
+        assert queue.pop().url == 'http://testdomain/a'
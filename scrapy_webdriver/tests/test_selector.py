@@ -0,0 +1,86 @@
+import pytest
+from mock import Mock
+
+from scrapy_webdriver.http import WebdriverResponse
+from scrapy_webdriver.selector import (GET_TEXTS, SELECT_STRINGS,
+                                       WebdriverXPathSelector)
+
+
+class TestSelector:
+    def selector(self, strings=None):
+        webdriver = Mock()
+        webdriver.execute_script.return_value = strings or []
+        return WebdriverXPathSelector(webdriver=webdriver)
+
+    def test_xpath_text(self):
+        sel = self.selector([u'one', u'two'])
+        assert sel.xpath('//td//text()').extract() == [u'one', u'two']
+        sel.webdriver.execute_script.assert_called_once_with(
+            SELECT_STRINGS, None, '//td', False, None, True)
+        assert not sel.webdriver.find_elements_by_xpath.called
+
+    def test_xpath_attribute(self):
+        sel = self.selector([u'/a', u'/b'])
+        assert sel.xpath('//a/@href').extract() == [u'/a', u'/b']
+        sel.webdriver.execute_script.assert_called_once_with(
+            SELECT_STRINGS, None, '//a', False, 'href', False)
+
+    def test_css_pseudo_elements(self):
+        sel = self.selector([u'one'])
+        assert sel.css('h2 ::text').extract() == [u'one']
+        sel.webdriver.execute_script.assert_called_once_with(
+            SELECT_STRINGS, None, 'h2', True, None, True)
+
+        sel = self.selector([u'/a'])
+        assert sel.css('a::attr(href)').extract() == [u'/a']
+        sel.webdriver.execute_script.assert_called_once_with(
+            SELECT_STRINGS, None, 'a', True, 'href', False)
+
+    def test_extract_elements(self):
+        sel = self.selector([u'one', u'two'])
+        elements = [Mock(), Mock()]
+        sel.webdriver.find_elements_by_xpath.return_value = elements
+        assert sel.xpath('//td').extract() == [u'one', u'two']
+        sel.webdriver.execute_script.assert_called_once_with(GET_TEXTS,
+                                                             elements)
+        assert not any(e.method_calls for e in elements)
+
+
+class TestSnapshotSelector:
+    body = ('<html><body><table>'
+            '<tr><td><a href="/a">one</a></td></tr>'
+            '<tr><td><a href="/b">two <b>&amp; more</b></a></td></tr>'
+            '</table></body></html>')
+
+    def response(self, webdriver=None):
+        if webdriver is None:
+            return WebdriverResponse('http://testdomain/', None,
+                                     body=self.body)
+        webdriver.page_source = self.body
+        return WebdriverResponse('http://testdomain/', webdriver)
+
+    def test_local_extraction(self):
+        webdriver = Mock()
+        sel = self.response(webdriver).selector
+        assert sel.xpath('//a/@href').extract() == [u'/a', u'/b']
+        assert sel.css('a::attr(href)').extract() == [u'/a', u'/b']
+        assert sel.xpath('//a//text()').extract() == [u'one', u'two ',
+                                                      u'& more']
+        assert sel.css('a')[1].extract_html() == u'two <b>&amp; more</b>'
+        assert not webdriver.method_calls
+
+    def test_live_element(self):
+        webdriver = Mock()
+        sel = self.response(webdriver).selector
+        link = sel.css('a')[1]
+        assert link.element is webdriver.find_element_by_xpath.return_value
+        webdriver.find_element_by_xpath.assert_called_once_with(
+            '/html/body/table/tr[2]/td/a')
+        assert sel.xpath('//a/@href')[0].element is None
+
+    def test_detached(self):
+        sel = self.response().selector
+        assert sel.xpath('//a/text()').extract() == [u'one', u'two ']
+        with pytest.raises(ValueError):
+            sel.css('a')[0].element
+
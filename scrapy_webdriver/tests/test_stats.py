@@ -0,0 +1,21 @@
+from mock import Mock
+from scrapy.statscol import MemoryStatsCollector
+
+from scrapy_webdriver.stats import (TIME_BOUNDS, record_histogram,
+                                    record_percentiles)
+
+
+def test_histogram():
+    stats = MemoryStatsCollector(Mock())
+    for seconds in [0.2] * 8 + [0.7, 300]:
+        record_histogram(stats, 'webdriver/timing/get', seconds, TIME_BOUNDS)
+    assert stats.get_value('webdriver/timing/get/count') == 10
+    assert stats.get_value('webdriver/timing/get/max') == 300
+    assert stats.get_value('webdriver/timing/get/le_0.25') == 8
+    assert stats.get_value('webdriver/timing/get/le_1') == 1
+    assert stats.get_value('webdriver/timing/get/le_inf') == 1
+
+    record_percentiles(stats)
+    assert stats.get_value('webdriver/timing/get/p50') == 0.25
+    assert stats.get_value('webdriver/timing/get/p90') == 1
+    assert stats.get_value('webdriver/timing/get/p99') == 300
@@ -0,0 +1,47 @@
+import json
+import os
+import shutil
+import tempfile
+
+from scrapy_webdriver.timeline import QUEUE_TID, TimelineWriter
+
+
+class TestTimelineWriter:
+    def setup_method(self, method):
+        self.path = tempfile.mkdtemp()
+        self.trace = os.path.join(self.path, 'trace.json')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.path)
+
+    def test_trace(self):
+        first, second = object(), object()
+        timeline = TimelineWriter(self.trace)
+        timeline.queued('http://testdomain/first', 0)
+        timeline.span(first, 'get', 0.5, 'http://testdomain/first')
+        timeline.span(second, 'callback', 0.2, 'http://testdomain/second')
+        timeline.released(first, 'http://testdomain/first')
+        timeline.close()
+        timeline.span(first, 'get', 0.5)  # ignored once closed
+
+        events = json.load(open(self.trace))
+        names = dict((event['tid'], event['args']['name'])
+                     for event in events if event['ph'] == 'M')
+        assert names == {QUEUE_TID: 'queue', 1: 'webdriver 1',
+                         2: 'webdriver 2'}
+        spans = [(event['tid'], event['name'], event['dur'])
+                 for event in events if event['ph'] == 'X']
+        assert spans == [(1, 'navigating', 5e5),
+                         (2, 'parsing under lock', 2e5)]
+        queued = [event for event in events if event.get('cat') == 'queue']
+        assert [event['ph'] for event in queued] == ['b', 'e']
+        assert queued[0]['id'] == queued[1]['id']
+
+    def test_unterminated(self):
+        timeline = TimelineWriter(self.trace)
+        timeline.span(object(), 'get', 0.5)
+        timeline._file.flush()
+        # Trace viewers accept a trace without its closing bracket.
+        events = json.loads(open(self.trace).read() + ']')
+        assert len(events) == 3
+        timeline.close()
@@ -0,0 +1,45 @@
+import signal
+
+from mock import Mock, patch
+
+from scrapy_webdriver.watchdog import WebdriverWatchdog, _Watch
+
+
+class TestWatchdog:
+    def test_expire(self):
+        watchdog = WebdriverWatchdog(10)
+        instance = Mock()
+        webdriver = instance._webdriver
+        watch = _Watch(instance, 'http://testdomain/')
+        watchdog._expire(watch)
+        webdriver.service.process.send_signal.assert_called_once_with(
+            signal.SIGTERM)
+        assert instance._webdriver is None
+        assert watchdog.unwatch(watch)
+
+    def test_expire_stops_proxy(self):
+        watchdog = WebdriverWatchdog(10)
+        instance = Mock(_browser=None)
+        webdriver = instance._webdriver
+        watchdog._expire(_Watch(instance, 'http://testdomain/'))
+        instance.manager._stop_proxy.assert_called_once_with(webdriver)
+
+    def test_unwatched(self):
+        watchdog = WebdriverWatchdog(10)
+        instance = Mock()
+        webdriver = instance._webdriver
+        watch = _Watch(instance, 'http://testdomain/')
+        assert not watchdog.unwatch(watch)
+        watchdog._expire(watch)
+        assert not webdriver.service.process.send_signal.called
+        assert instance._webdriver is webdriver
+
+    def test_unwatch_cancels(self):
+        watchdog = WebdriverWatchdog(10)
+        with patch('scrapy_webdriver.watchdog.reactor') as reactor:
+            reactor.callFromThread.side_effect = lambda f, *args: f(*args)
+            watch = watchdog.watch(Mock(), 'http://testdomain/')
+            reactor.callLater.assert_called_once_with(10, watchdog._expire,
+                                                      watch)
+            assert not watchdog.unwatch(watch)
+        watch.call.cancel.assert_called_once_with()
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+from selenium.common.exceptions import WebDriverException
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone
+from twisted.web.http_headers import Headers
+
+from scrapy_webdriver.wire import WebdriverClient
+
+
+class FakeResponse(object):
+    def __init__(self, code, body):
+        self.code = code
+        self.phrase = 'OK' if code < 400 else 'Error'
+        self.headers = Headers()
+        self.length = len(body)
+        self.body = body
+
+    def deliverBody(self, protocol):
+        protocol.dataReceived(self.body)
+        protocol.connectionLost(Failure(ResponseDone()))
+
+
+class FakeAgent(object):
+    """Answers requests synchronously, with canned results."""
+    def __init__(self, *results):
+        self.results = list(results)
+        self.requests = []
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        body = None
+        if bodyProducer is not None:
+            body = json.loads(bodyProducer._inputFile.read())
+        self.requests.append((method, uri, body))
+        code, result = self.results.pop(0)
+        return defer.succeed(FakeResponse(code, json.dumps(result)))
+
+
+def result_of(dfd):
+    results = []
+    dfd.addBoth(results.append)
+    result, = results
+    if isinstance(result, Failure):
+        result.raiseException()
+    return result
+
+
+class TestWire:
+    def client(self, *results):
+        client = WebdriverClient('http://hub/wd/hub/')
+        client._agent = FakeAgent(*results)
+        return client
+
+    def test_session(self):
+        client = self.client(
+            (200, {'status': 0, 'sessionId': 'abc',
+                   'value': {'browserName': 'phantomjs'}}),
+            (200, {'status': 0, 'value': None}),
+            (200, {'status': 0, 'value': '<html></html>'}))
+        session = result_of(client.new_session({'browserName': 'phantomjs'}))
+        assert session.session_id == 'abc'
+        assert session.capabilities == {'browserName': 'phantomjs'}
+        result_of(session.get('http://testdomain/'))
+        assert result_of(session.page_source) == '<html></html>'
+        assert client._agent.requests == [
+            ('POST', 'http://hub/wd/hub/session',
+             {'desiredCapabilities': {'browserName': 'phantomjs'}}),
+            ('POST', 'http://hub/wd/hub/session/abc/url',
+             {'url': 'http://testdomain/'}),
+            ('GET', 'http://hub/wd/hub/session/abc/source', None),
+        ]
+
+    def test_w3c_session(self):
+        client = self.client(
+            (200, {'value': {'sessionId': 'abc',
+                             'capabilities': {'browserName': 'chrome'}}}))
+        with pytest.raises(WebDriverException):
+            result_of(client.new_session({'browserName': 'chrome'}))
+
+    def test_error(self):
+        client = self.client((500, {'status': 13,
+                                    'value': {'message': 'it broke'}}))
+        with pytest.raises(WebDriverException):
+            result_of(client.execute('GET', '/status'))
@@ -0,0 +1,93 @@
+import json
+from itertools import count
+from threading import RLock
+from time import time
+
+# The names of the render path timings on the timeline.
+SPAN_NAMES = {
+    'lease': 'acquired',
+    'get': 'navigating',
+    'page_source': 'serializing',
+    'callback': 'parsing under lock',
+    'connect': 'connecting',
+    'reconnect': 'reconnecting',
+}
+PID = 1
+QUEUE_TID = 0
+
+
+class TimelineWriter(object):
+    """Writes the render path of the requests to a Chrome trace file.
+
+    The file is in the Trace Event Format (JSON array), that the Chrome
+    ``about:tracing`` page and Perfetto load. Every webdriver instance has a
+    track of its own, with the spans of the requests leasing it, and the
+    time requests spend queued is shown on a separate track.
+
+    Events are written as they come, through the file buffer, so that the
+    memory used doesn't grow with the crawl. A trace cut short by a crash can
+    still be loaded, the closing bracket being optional.
+
+    """
+    def __init__(self, path):
+        self._file = open(path, 'w')
+        self._lock = RLock()
+        self._epoch = time()
+        self._tracks = {}
+        self._ids = count()
+        self._separator = '[\n'
+        self._write({'name': 'thread_name', 'ph': 'M', 'pid': PID,
+                     'tid': QUEUE_TID, 'args': {'name': 'queue'}})
+
+    def span(self, instance, name, seconds, url=None):
+        """Write the span of a timing that just ended on an instance."""
+        end = time()
+        self._write({'name': SPAN_NAMES.get(name, name), 'ph': 'X',
+                     'pid': PID, 'tid': self._track(instance),
+                     'ts': self._ts(end - seconds), 'dur': seconds * 1e6,
+                     'args': {'url': url}})
+
+    def released(self, instance, url=None):
+        """Write the moment an instance is released."""
+        self._write({'name': 'released', 'ph': 'i', 's': 't', 'pid': PID,
+                     'tid': self._track(instance), 'ts': self._ts(time()),
+                     'args': {'url': url}})
+
+    def queued(self, url, since):
+        """Write the time a request spent queued, up to now.
+
+        Queued requests overlap, so they are written as async events, that
+        trace viewers lay out on as many rows as needed.
+
+        """
+        event = {'name': 'queued', 'cat': 'queue', 'id': next(self._ids),
+                 'pid': PID, 'tid': QUEUE_TID, 'args': {'url': url}}
+        self._write(dict(event, ph='b', ts=self._ts(since)))
+        self._write(dict(event, ph='e', ts=self._ts(time())))
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.write('\n]\n')
+                self._file.close()
+
+    def _track(self, instance):
+        key = id(instance)
+        with self._lock:
+            if key not in self._tracks:
+                self._tracks[key] = tid = len(self._tracks) + 1
+                self._write({'name': 'thread_name', 'ph': 'M', 'pid': PID,
+                             'tid': tid,
+                             'args': {'name': 'webdriver %d' % tid}})
+            return self._tracks[key]
+
+    def _ts(self, timestamp):
+        return (timestamp - self._epoch) * 1e6
+
+    def _write(self, event):
+        data = json.dumps(event)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(self._separator + data)
+            self._separator = ',\n'
@@ -0,0 +1,147 @@
+"""Readiness conditions evaluated in the browser.
+
+See the ``wait_until`` argument of ``WebdriverRequest``.
+
+"""
+# Call back with true once all the conditions of the spec hold, or with false
+# after the timeout. Conditions are checked on every DOM mutation, and every
+# 50ms for those that mutations don't tell about.
+WAIT_FUNCTION = """
+function waitUntil(spec, timeout, done) {
+    var start = Date.now(), mutated = start, loaded = start, finished = false;
+
+    function resources() {
+        return window.performance && performance.getEntriesByType ?
+            performance.getEntriesByType('resource').length : 0;
+    }
+    var resourceCount = resources();
+
+    function ready() {
+        var now = Date.now();
+        if (spec.css && !document.querySelector(spec.css)) {
+            return false;
+        }
+        if (spec.xpath && !document.evaluate(
+                spec.xpath, document, null,
+                XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue) {
+            return false;
+        }
+        if (spec.js && !(new Function(spec.js))()) {
+            return false;
+        }
+        if (spec.dom_quiet && now - mutated < spec.dom_quiet) {
+            return false;
+        }
+        if (spec.network_idle) {
+            var count = resources();
+            if (count != resourceCount) {
+                resourceCount = count;
+                loaded = now;
+            }
+            if (document.readyState != 'complete' ||
+                    now - loaded < spec.network_idle) {
+                return false;
+            }
+        }
+        return true;
+    }
+
+    function finish(result) {
+        finished = true;
+        observer.disconnect();
+        clearInterval(timer);
+        done(result);
+    }
+
+    function check() {
+        if (finished) {
+            return;
+        }
+        if (ready()) {
+            finish(true);
+        } else if (Date.now() - start >= timeout) {
+            finish(false);
+        }
+    }
+
+    var observer = new MutationObserver(function () {
+        mutated = Date.now();
+        check();
+    });
+    observer.observe(document, {childList: true, subtree: true,
+                                attributes: true, characterData: true});
+    var timer = setInterval(check, 50);
+    check();
+}
+"""
+WAIT_UNTIL = WAIT_FUNCTION + """
+waitUntil(arguments[0], arguments[1], arguments[arguments.length - 1]);
+"""
+
+# Navigate to a page without waiting for it, flagging the current page so that
+# it is told apart from the new one.
+NAVIGATE = """
+window.__webdriverStale = true;
+var url = arguments[0];
+setTimeout(function () { window.location.href = url; }, 0);
+"""
+# Return whether the new page reached the given page load strategy.
+NAVIGATED = """
+var strategy = arguments[0];
+if (window.__webdriverStale) {
+    return false;
+}
+if (strategy == 'normal') {
+    return document.readyState == 'complete';
+}
+return strategy == 'none' || document.readyState != 'loading';
+"""
+STRATEGIES = ('none', 'eager', 'normal')
+
+CONDITIONS = ('css', 'xpath', 'js', 'network_idle', 'dom_quiet')
+
+
+def check_spec(spec):
+    """Raise ValueError if the ``wait_until`` spec is not valid.
+
+    A spec is a dict with any of the following keys, all of which must be
+    satisfied for the page to be ready:
+
+    * ``css`` or ``xpath``: a selector matching at least one element,
+    * ``js``: the body of a JavaScript function returning true,
+    * ``network_idle``: no resource loaded for that many milliseconds, after
+      the page load event (the browser doesn't tell about pending requests),
+    * ``dom_quiet``: no DOM mutation for that many milliseconds,
+
+    and optionally a ``timeout`` in seconds, after which the page is given up
+    waiting for and returned as is.
+
+    """
+    if not isinstance(spec, dict):
+        raise ValueError('wait_until must be a dict, got %r.' % (spec,))
+    unknown = set(spec) - set(CONDITIONS) - set(['timeout'])
+    if unknown:
+        raise ValueError('Unknown wait_until conditions: %s.' %
+                         ', '.join(sorted(unknown)))
+    if not set(spec) & set(CONDITIONS):
+        raise ValueError('wait_until needs at least one of %s.' %
+                         ', '.join(CONDITIONS))
+
+
+def timeouts(target):
+    """Return the timeouts last set on a webdriver or wire session, by kind.
+
+    This is how timeouts are only set when they change. The dict is shared by
+    the shallow copies of a webdriver, like the tabs of a browser (see
+    ``WEBDRIVER_TABS``), since they share its session.
+
+    """
+    return vars(target).setdefault('_timeouts', {})
+
+
+def extend_script_timeout(webdriver, seconds):
+    """Make sure that asynchronous scripts may run for that long."""
+    timeout = timeouts(webdriver).get('script')
+    if timeout is None or timeout < seconds:
+        webdriver.set_script_timeout(seconds)
+        timeouts(webdriver)['script'] = seconds
@@ -0,0 +1,89 @@
+import signal
+from threading import Lock
+
+from scrapy import log
+from twisted.internet import reactor
+
+
+class WebdriverWatchdog(object):
+    """Kills the browsers whose navigation takes too long.
+
+    Each in-flight navigation has its own deadline, checked from the reactor
+    thread, so that it works with navigations running in any thread and with
+    any number of webdriver instances. When a navigation misses its deadline,
+    only the webdriver instance it runs in is killed.
+
+    """
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._lock = Lock()
+
+    def watch(self, instance, url):
+        """Start watching a navigation, from the thread that runs it."""
+        watch = _Watch(instance, url)
+        reactor.callFromThread(self._schedule, watch)
+        return watch
+
+    def unwatch(self, watch):
+        """Stop watching a navigation, return whether it missed its deadline.
+        """
+        with self._lock:
+            watch.done = True
+            expired = watch.expired
+        if not expired:
+            reactor.callFromThread(self._cancel, watch)
+        return expired
+
+    def _schedule(self, watch):
+        watch.call = reactor.callLater(self.timeout, self._expire, watch)
+
+    def _cancel(self, watch):
+        # scheduled before, the calls from threads running in order
+        if watch.call is not None and watch.call.active():
+            watch.call.cancel()
+
+    def _expire(self, watch):
+        with self._lock:
+            if watch.done:
+                return
+            watch.expired = True
+        log.msg("WebDriver.get for '%s' took more than WEBDRIVER_HANG_TIMEOUT "
+                "(%ss)" % (watch.url, self.timeout), level=log.INFO)
+        self._kill(watch.instance)
+
+    def _kill(self, instance):
+        webdriver, instance._webdriver = instance._webdriver, None
+        if webdriver is None:
+            return
+        # the instance reconnects without its old webdriver, whose proxy has
+        # to be stopped from here
+        if instance._browser is None:
+            instance.manager._stop_proxy(webdriver)
+        # kill the selenium webdriver process (with SIGTERM, so that it kills
+        # both the primary process and the process that gets spawned)
+        try:
+            process = webdriver.service.process
+        except AttributeError:
+            # remote webdrivers have no process to kill, their session is
+            # quit from a thread instead, as this blocks
+            reactor.callInThread(_quit_quietly, webdriver)
+        else:
+            process.send_signal(signal.SIGTERM)
+
+
+class _Watch(object):
+    """A navigation watched by a ``WebdriverWatchdog``."""
+    def __init__(self, instance, url):
+        self.instance = instance
+        self.url = url
+        self.done = False
+        self.expired = False
+        self.call = None
+
+
+def _quit_quietly(webdriver):
+    try:
+        webdriver.quit()
+    except Exception, exception:
+        log.msg('Error while quitting a hung webdriver (%s)' % exception,
+                level=log.DEBUG)
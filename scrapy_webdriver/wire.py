@@ -0,0 +1,105 @@
+"""An asynchronous client for the WebDriver JSON wire protocol.
+
+It speaks to a remote webdriver (e.g. a selenium grid hub) over twisted's HTTP
+client, with persistent connections, so that remote browser sessions can be
+driven from the reactor thread with deferreds instead of one blocked thread
+per navigation. Only the few commands the download handler needs are
+implemented, in the JSON wire protocol: end points that only speak the W3C
+WebDriver protocol are not supported.
+
+"""
+import json
+from cStringIO import StringIO
+
+from selenium.common.exceptions import WebDriverException
+from twisted.internet import defer, reactor
+from twisted.web.client import (Agent, FileBodyProducer, HTTPConnectionPool,
+                                readBody)
+from twisted.web.http_headers import Headers
+
+
+class WebdriverClient(object):
+    """Creates sessions on a remote webdriver end point."""
+    def __init__(self, url, pool=None):
+        self.url = url.rstrip('/')
+        if pool is None:
+            pool = HTTPConnectionPool(reactor, persistent=True)
+        self._agent = Agent(reactor, pool=pool)
+
+    def new_session(self, desired_capabilities):
+        """Return a deferred fired with a new ``WebdriverSession``."""
+        dfd = self.execute('POST', '/session',
+                           {'desiredCapabilities': desired_capabilities},
+                           raw=True)
+        dfd.addCallback(self._make_session)
+        return dfd
+
+    def _make_session(self, result):
+        # W3C sessions have their id in the value, and wouldn't understand
+        # the commands sent to them
+        if not result.get('sessionId'):
+            raise WebDriverException('%s did not start a JSON wire protocol '
+                                     'session: %r' % (self.url, result))
+        return WebdriverSession(self, result['sessionId'], result.get('value'))
+
+    @defer.inlineCallbacks
+    def execute(self, method, path, params=None, raw=False):
+        """Send a command, return a deferred fired with its result value."""
+        headers = Headers({'Accept': ['application/json'],
+                           'Content-Type': ['application/json;charset=UTF-8']})
+        producer = None
+        if params is not None:
+            producer = FileBodyProducer(StringIO(json.dumps(params)))
+        response = yield self._agent.request(method, self.url + path, headers,
+                                             producer)
+        body = yield readBody(response)
+        try:
+            result = json.loads(body) if body else {}
+        except ValueError:
+            raise WebDriverException('Invalid response to %s %s (%s): %r' %
+                                     (method, path, response.code, body[:200]))
+        value = result.get('value')
+        if result.get('status') or response.code >= 400:
+            message = value.get('message') if isinstance(value, dict) else value
+            raise WebDriverException('%s %s failed (%s): %s' %
+                                     (method, path, response.code, message))
+        defer.returnValue(result if raw else value)
+
+
+class WebdriverSession(object):
+    """A remote browser session, whose commands all return deferreds."""
+    def __init__(self, client, session_id, capabilities):
+        self.client = client
+        self.session_id = session_id
+        self.capabilities = capabilities
+
+    def execute(self, method, command, params=None):
+        path = '/session/%s%s' % (self.session_id, command)
+        return self.client.execute(method, path, params)
+
+    def get(self, url):
+        return self.execute('POST', '/url', {'url': url})
+
+    @property
+    def page_source(self):
+        return self.execute('GET', '/source')
+
+    @property
+    def current_url(self):
+        return self.execute('GET', '/url')
+
+    def execute_script(self, script, *args):
+        return self.execute('POST', '/execute',
+                            {'script': script, 'args': list(args)})
+
+    def execute_async_script(self, script, *args):
+        return self.execute('POST', '/execute_async',
+                            {'script': script, 'args': list(args)})
+
+    def set_timeout(self, kind, seconds):
+        """Set the ``'page load'``, ``'script'`` or ``'implicit'`` timeout."""
+        return self.execute('POST', '/timeouts',
+                            {'type': kind, 'ms': int(seconds * 1000)})
+
+    def quit(self):
+        return self.execute('DELETE', '')
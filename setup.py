@@ -62,7 +62,7 @@ setup(
         'Topic :: Software Development :: Libraries :: Python Modules',
         'Topic :: Internet :: WWW/HTTP',
     ],
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     install_requires=install_requirements,
     zip_safe=False,
     tests_require=['mock', 'pytest', 'scrapy'],